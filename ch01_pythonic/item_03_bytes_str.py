@@ -102,3 +102,259 @@ with open("./ch01_pythonic/data.bin",
 import locale
 print(locale.getpreferredencoding())
 
+
+
+'''大量のbytes/strを変換するためのバッチ版とストリーミング版'''
+# to_str/to_bytesは1つずつ変換する. 数百万件の混在データを変換するならイテラブルを受け取るバッチ版を使う.
+# bytearray/memoryviewもそのまま受け付け, bytes()で一度コピーしてからdecodeするようなことはしない.
+import codecs
+import time
+
+'''iterable of bytes-like or str -> list of str'''
+def to_str_batch(values, encoding='utf-8'):
+    # バッファから直接デコードする(中間のbytesを作らない)
+    return [value if isinstance(value, str) else str(value, encoding)
+            for value in values]
+
+'''iterable of bytes-like or str -> list of bytes-like'''
+def to_bytes_batch(values, encoding='utf-8'):
+    # bytearray/memoryviewはコピーせずそのまま返す
+    return [value.encode(encoding) if isinstance(value, str) else value
+            for value in values]
+
+records = [b'foo', 'bar', bytearray(b'baz'), memoryview(b'qux'), '井上']
+print(list(to_str_batch(records)))
+print([bytes(value) for value in to_bytes_batch(records)])
+
+# 返り値は元のバッファを共有している(コピーされていない)
+buffer = bytearray(b'hello')
+view = to_bytes_batch([memoryview(buffer)])[0]
+buffer[0] = ord('j')
+assert bytes(view) == b'jello'
+
+# チャンクに分けて届くデータは, マルチバイト文字(UTF-8で2〜4バイト)がチャンクの境界で分断されうる.
+# 1チャンクずつdecode()すると壊れるので, codecsのインクリメンタルデコーダで続きを持ち越す.
+chunks = [b'\xe4\xba', b'\x95\xe4\xb8\x8a'] # '井上'の途中で分断
+try:
+    print([chunk.decode('utf-8') for chunk in chunks])
+except UnicodeDecodeError as e:
+    print(f'Error: {e}')
+
+'''iterable of bytes-like chunks -> iterator of str'''
+def decode_stream(chunks, encoding='utf-8', errors='strict'):
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True) # 末尾に中途半端なバイト列が残っていればここでエラー
+    if text:
+        yield text
+
+'''iterable of str chunks -> iterator of bytes'''
+def encode_stream(chunks, encoding='utf-8', errors='strict'):
+    encoder = codecs.getincrementalencoder(encoding)(errors)
+    for chunk in chunks:
+        data = encoder.encode(chunk)
+        if data:
+            yield data
+    data = encoder.encode('', final=True)
+    if data:
+        yield data
+
+print(list(decode_stream(chunks)))
+assert ''.join(decode_stream(chunks)) == '井上'
+
+# 1バイトずつ送ってもすべての境界を正しく扱える
+text = 'à props 井上真一 🐍'
+data = b''.join(encode_stream([text[:5], text[5:]]))
+assert data == text.encode('utf-8')
+assert ''.join(decode_stream(memoryview(data)[i:i + 1] for i in range(len(data)))) == text
+
+# UTF-16のようなBOM付きの符号化でも, BOMは先頭に1回だけ書かれる
+data = b''.join(encode_stream(['井上', '真一'], encoding='utf-16'))
+assert data == '井上真一'.encode('utf-16')
+
+# ベンチマーク: スカラー版とバッチ版で混在データを変換する
+records = []
+for i in range(200000):
+    if i % 3 == 0:
+        records.append(f'record {i}')
+    elif i % 3 == 1:
+        records.append(f'record {i}'.encode())
+    else:
+        records.append(memoryview(f'record {i}'.encode()))
+
+start = time.perf_counter()
+scalar = [to_str(bytes(value) if isinstance(value, memoryview) else value)
+          for value in records] # スカラー版はmemoryviewを受け付けないのでコピーが必要
+end = time.perf_counter()
+print(f'to_str: {end - start:.3f} seconds')
+
+start = time.perf_counter()
+batch = to_str_batch(records)
+end = time.perf_counter()
+print(f'to_str_batch: {end - start:.3f} seconds')
+assert scalar == batch
+
+start = time.perf_counter()
+scalar = [to_bytes(value) for value in records]
+end = time.perf_counter()
+print(f'to_bytes: {end - start:.3f} seconds')
+
+start = time.perf_counter()
+batch = to_bytes_batch(records)
+end = time.perf_counter()
+print(f'to_bytes_batch: {end - start:.3f} seconds')
+
+
+'''巨大なファイルをmmapで読む'''
+# f.read()はファイル全体をメモリに読み込み, 'r'モードなら全体を一度にデコードしてしまう.
+# mmapでファイルをマップすれば, memoryviewのスライスはコピーなしでファイルの一部を指す.
+# 必要な範囲だけをデコードし, 行単位で読めば数GBのログでも一定のメモリで走査できる.
+import mmap
+import os
+import sys
+import tempfile
+
+# BOMごとにバイト順まで決まったエンコーディングにする. 'utf-16'/'utf-32'のエンコーダは
+# BOMが無いと実行しているマシンのバイト順を使うので, 改行の探索や途中からの復号に使えない
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32-le'), # UTF-16 LEのBOMと先頭が同じなので先に調べる
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+]
+
+# BOMを見てバイト順を決めるエンコーディング
+BOM_ENCODINGS = {'utf-8-sig', 'utf-16', 'utf-32'}
+
+'''BOMがあれば(エンコーディング, BOMのバイト数)を, 無ければ(None, 0)を返す'''
+def detect_bom(data):
+    head = bytes(data[:4])
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    return None, 0
+
+'''BOM -> UTF-8として読めるか -> システムのデフォルトロケールの順に推定する'''
+def detect_encoding(data, sample_size=64 * 1024):
+    encoding, _ = detect_bom(data)
+    if encoding is not None:
+        return encoding
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        decoder.decode(data[:sample_size]) # 末尾で分断された文字はエラーにしない
+    except UnicodeDecodeError:
+        return locale.getpreferredencoding()
+    return 'utf-8'
+
+class MappedFile:
+    def __init__(self, path, encoding=None):
+        self.file = open(path, 'rb')
+        if os.fstat(self.file.fileno()).st_size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+        else:
+            self.map = None # 空のファイルはmmapできない
+            self.view = memoryview(b'')
+        # encodingはバイト順まで決まったもの, offsetはBOMを除いた本文の始まり
+        bom_encoding, bom_size = detect_bom(self.view)
+        self.offset = 0
+        if encoding is None or codecs.lookup(encoding).name in BOM_ENCODINGS:
+            if bom_encoding is not None:
+                encoding = bom_encoding
+                self.offset = bom_size
+            elif encoding is None:
+                encoding = detect_encoding(self.view)
+        self.encoding = encoding
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # 返したスライスがまだ生きているとmmapは閉じられない(BufferError)
+        self.view.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.view)
+
+    def slice(self, start, stop):
+        return self.view[start:stop] # コピーなし
+
+    def decode(self, start, stop, errors='strict'):
+        with self.view[start:stop] as region:
+            return str(region, self.encoding, errors)
+
+    def iter_lines(self, keepends=False, errors='strict'):
+        # 改行の符号化. UTF-16/32では符号単位の境界に揃っている位置だけを改行とみなす
+        codec = codecs.lookup(self.encoding)
+        newline = codec.encode('\n')[0]
+        decoder = codec.incrementaldecoder(errors)
+
+        start = self.offset # BOMは読み飛ばす
+        end = len(self.map) if self.map is not None else 0
+        while start < end:
+            index = self.map.find(newline, start)
+            while index != -1 and (index - start) % len(newline):
+                index = self.map.find(newline, index + 1)
+            if index == -1:
+                stop = end
+                line_end = end
+            else:
+                stop = index + len(newline)
+                line_end = stop if keepends else index
+            with self.view[start:line_end] as region:
+                yield decoder.decode(region)
+            start = stop
+
+# data.binはUTF-8として読めないので, システムのデフォルトロケールにフォールバックする
+with MappedFile('./ch01_pythonic/data.bin') as f:
+    print(f.encoding, bytes(f.slice(0, len(f))))
+
+with MappedFile('./ch01_pythonic/data.bin', encoding='cp1252') as f:
+    print(f.decode(0, len(f)))
+
+# 大きめのログファイルを作り, 行ごとに読む
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, 'big.log')
+    lines = [f'{i} 井上真一 à props' for i in range(100000)]
+    native = 'le' if sys.byteorder == 'little' else 'be'
+    # (書き込むエンコーディング, 先頭に書くBOM, 推定されるエンコーディング, BOMのバイト数)
+    cases = [
+        ('utf-8', '', 'utf-8', 0),
+        ('utf-8-sig', '', 'utf-8', 3),
+        ('utf-16', '', f'utf-16-{native}', 2),
+        ('utf-32', '', f'utf-32-{native}', 4),
+        ('utf-16-be', '\ufeff', 'utf-16-be', 2), # BOM付きのビッグエンディアン
+        ('utf-32-be', '\ufeff', 'utf-32-be', 4),
+    ]
+    for encoding, bom, expected_encoding, offset in cases:
+        with open(path, 'w', encoding=encoding, newline='\n') as f:
+            f.write(bom + '\n'.join(lines))
+
+        with MappedFile(path) as f:
+            assert (f.encoding, f.offset) == (expected_encoding, offset), f.encoding
+            count = 0
+            for expected, line in zip(lines, f.iter_lines()):
+                assert line == expected, (line, expected)
+                count += 1
+            assert count == len(lines)
+            stop = f.offset + len('0 井上'.encode(f.encoding))
+            assert f.decode(f.offset, stop) == '0 井上'
+        print(f'{encoding}{" + BOM" if bom else ""}: {count} lines ({f.encoding})')
+
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    with MappedFile(path) as f:
+        assert list(f.iter_lines(keepends=True)) == [line + '\n' for line in lines]
+        start = len('0 '.encode())
+        print(f.decode(start, start + len('井上真一'.encode())))
@@ -0,0 +1,49 @@
+# 第7章のスクリプトで共通の準備(書籍の実行環境の再現)
+#
+# 以前は各スクリプトの先頭でlogging, pprint, tempfile, gc, io, randomを使わなくてもimportしていた.
+# 短命なワーカーをたくさん起動するとその分だけ起動時間がかさむので,
+# ここではモジュールの__getattr__(PEP 562)で, 属性に初めて触れたときにimportする.
+#
+#   from bootstrap import setup_environment  # bootstrap.environmentをimport
+#   from bootstrap import random             # randomをimportしてseed(1234)する
+#
+# 起動時間の予算のチェックは `python -m bootstrap` で行う.
+
+import sys
+
+# 属性名 -> (モジュール名, モジュール内の属性名. Noneならモジュールそのもの)
+LAZY_ATTRIBUTES = {
+    'logging': ('logging', None),
+    'pprint': ('pprint', 'pprint'),
+    'STDOUT': ('sys', 'stdout'),
+    'random': ('random', None),
+    'setup_environment': ('bootstrap.environment', 'setup_environment'),
+    'close_open_files': ('bootstrap.environment', 'close_open_files'),
+    'load_definitions': ('bootstrap.worker', 'load_definitions'),
+    'start_worker': ('bootstrap.worker', 'start_worker'),
+    'worker_pool': ('bootstrap.worker', 'worker_pool'),
+    'gil_enabled': ('bootstrap.parallel', 'gil_enabled'),
+    'parallel_map': ('bootstrap.parallel', 'parallel_map'),
+    'SubinterpreterExecutor': ('bootstrap.subinterpreters', 'SubinterpreterExecutor'),
+    'interpreter_map': ('bootstrap.subinterpreters', 'interpreter_map'),
+    'subinterpreters_available': ('bootstrap.subinterpreters', 'available'),
+}
+
+def __getattr__(name):
+    try:
+        module_name, attribute = LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+
+    __import__(module_name) # importlibのimportすら省く
+    value = sys.modules[module_name]
+    if attribute is not None:
+        value = getattr(value, attribute)
+    if name == 'random':
+        value.seed(1234) # Reproduce book environment
+
+    globals()[name] = value # 2回目以降は__getattr__を通らない
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY_ATTRIBUTES))
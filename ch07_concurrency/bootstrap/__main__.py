@@ -0,0 +1,69 @@
+# python -m bootstrap
+# `python -X importtime` でbootstrapのimportにかかる時間を測り, 予算内に収まっているか確かめる.
+# 予算は同じ実行の中で測った, 重いモジュールをそのままimportしたとき(eager)の時間に対する割合.
+# 絶対時間だと.pycの有無やマシンの負荷でぶれて失敗するが, 割合なら両方が同じように遅くなる.
+# 重いモジュールを誤ってトップレベルでimportするようになると, ここで失敗する.
+
+import os
+import subprocess
+import sys
+
+# ワーカー側はスクリプトを読むためにast, symtable, pickleが必要な分だけ予算が大きい
+IMPORT_BUDGETS = {
+    'import bootstrap': 0.25,
+    'from bootstrap import setup_environment': 0.5,
+    'from bootstrap import load_definitions': 0.6,
+}
+HEAVY_MODULES = ['logging', 'pprint', 'tempfile', 'random']
+
+def measure_import_time(statement, repeat=3):
+    # 測定はぶれるので, モジュールごとに何回か測った中の最小値を使う
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cumulative = {}
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', statement],
+            cwd=package_dir,
+            capture_output=True,
+            encoding='utf-8',
+            check=True,
+        )
+        # import time: self [us] | cumulative | imported package
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative_us, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            cumulative[name] = min(int(cumulative_us),
+                                   cumulative.get(name, sys.maxsize))
+    return cumulative
+
+cumulative = measure_import_time('import logging, pprint, tempfile, random')
+eager = sum(cumulative[name] for name in HEAVY_MODULES)
+print(f'eager imports of {HEAVY_MODULES}: {eager} us')
+
+# setup_environmentまで含めたスクリプトの先頭部分と, ワーカーで使う部分を測る
+for statement, ratio in IMPORT_BUDGETS.items():
+    cumulative = measure_import_time(statement)
+    total = sum(cumulative.get(name, 0) for name in
+                ['bootstrap', 'bootstrap.environment', 'bootstrap.worker'])
+    heavy = [name for name in HEAVY_MODULES if name in cumulative]
+    budget = int(eager * ratio)
+    print(f'{statement}: {total} us (budget {budget} us = eager x {ratio}), '
+          f'heavy modules: {heavy}')
+    assert total < budget, f'{statement} took {total} us'
+    assert not heavy, heavy
+
+# スクリプトのExampleを実行せずに, 関数だけをワーカープロセスで動かす
+import time
+from bootstrap import start_worker
+
+script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'item_53_threading.py')
+numbers = [2139079, 1214759, 1516637, 1852285]
+start = time.time()
+workers = [start_worker(script, 'factorize', number) for number in numbers]
+results = [worker.result(timeout=60) for worker in workers]
+end = time.time()
+assert results[0] == [1, 101, 21179, 2139079]
+print(f'{len(workers)} workers took {end - start:.3f} seconds')
@@ -0,0 +1,131 @@
+# 各項目のスクリプトで共通の, 書籍の実行環境を再現するための準備
+# - 出力はすべて一時ディレクトリに書く
+# - 終了時に開いたままのファイルやパイプを閉じる
+#
+# 以前は各スクリプトにコピーされたclose_open_filesが終了時にgc.get_objects()で
+# ヒープ上の全オブジェクトをisinstanceで調べていた. オブジェクトが数百万あると終了に数秒かかる.
+# ここではopen()の時点でファイルを弱参照のレジストリに登録し, 終了時にはそれだけを閉じる.
+# 差し替えはsetup_environment()の中で行うので, importするだけのワーカーやサブインタプリタには影響しない.
+# open()を通らないsocket.makefile()のファイルも登録するが, それ以外に直接作ったio.BufferedReaderなどは
+# gcで探していた以前と違って登録されないので, スクリプト側で閉じるかOPEN_FILES.add()で登録する.
+
+import atexit
+import builtins
+import io
+import os
+import sys
+import weakref
+
+OPEN_FILES = weakref.WeakSet()
+
+_original_open = io.open
+
+def tracked_open(*args, **kwargs):
+    file = _original_open(*args, **kwargs)
+    OPEN_FILES.add(file)
+    return file
+
+def track_makefile(socket_class):
+    makefile = socket_class.makefile
+
+    def tracked_makefile(self, *args, **kwargs):
+        file = makefile(self, *args, **kwargs)
+        OPEN_FILES.add(file)
+        return file
+
+    socket_class.makefile = tracked_makefile
+
+class SocketImportHook:
+    # socketのimportは重い(約10ms)ので自分ではimportせず, スクリプトがimportしたときに差し替える
+    def find_spec(self, name, path, target=None):
+        if name != 'socket':
+            return None
+        sys.meta_path.remove(self)
+        for finder in sys.meta_path:
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        exec_module = spec.loader.exec_module
+
+        def exec_and_track(module):
+            exec_module(module)
+            track_makefile(module.socket)
+
+        spec.loader.exec_module = exec_and_track
+        return spec
+
+def install_open_hooks():
+    # builtins.openだけでなくio.openも差し替えると, os.fdopen()経由で作られる
+    # subprocessのパイプ(Popen.stdin/stdout/stderr)も登録される
+    builtins.open = tracked_open
+    io.open = tracked_open
+    if 'socket' in sys.modules:
+        track_makefile(sys.modules['socket'].socket)
+    else:
+        sys.meta_path.insert(0, SocketImportHook())
+
+def close_open_files():
+    for file in list(OPEN_FILES):
+        try:
+            file.close()
+        except OSError:
+            pass # 相手が先に切ったソケットへの書き出しなど
+
+TEST_DIR = None
+OLD_CWD = None
+
+def setup_environment():
+    global TEST_DIR, OLD_CWD
+    if TEST_DIR is not None:
+        return
+
+    # Write all output to a temporary directory
+    import tempfile # 重いのでワーカーなどsetupしない場合はimportしない
+    TEST_DIR = tempfile.TemporaryDirectory()
+    atexit.register(TEST_DIR.cleanup)
+
+    # Make sure Windows processes exit cleanly
+    OLD_CWD = os.getcwd()
+    atexit.register(lambda: os.chdir(OLD_CWD))
+    os.chdir(TEST_DIR.name)
+
+    install_open_hooks()
+    atexit.register(close_open_files)
+
+
+if __name__ == '__main__':
+    # 終了処理の時間がヒープの大きさに比例しないことを確かめる
+    import gc
+    import time
+
+    def close_open_files_by_gc():
+        everything = gc.get_objects()
+        for obj in everything:
+            # 標準入出力(とその下のバッファ)まで閉じるとprintできなくなるので除く
+            if (isinstance(obj, io.IOBase) and
+                    getattr(obj, 'name', None) not in STANDARD_STREAMS):
+                obj.close()
+
+    STANDARD_STREAMS = ('<stdin>', '<stdout>', '<stderr>', 0, 1, 2)
+    setup_environment()
+    heap = []
+    for size in (10**5, 10**6, 3 * 10**6):
+        heap.extend([[] for _ in range(size - len(heap))])
+        files = [open(f'file_{i}.txt', 'w') for i in range(10)]
+
+        start = time.perf_counter()
+        close_open_files()
+        registry_delta = time.perf_counter() - start
+        assert all(f.closed for f in files)
+
+        files = [open(f'file_{i}.txt', 'w') for i in range(10)]
+        start = time.perf_counter()
+        close_open_files_by_gc()
+        gc_delta = time.perf_counter() - start
+        assert all(f.closed for f in files)
+
+        print(f'{size:>8} objects: registry {registry_delta:.6f} seconds, '
+              f'gc scan {gc_delta:.6f} seconds')
+        assert registry_delta < 0.01
@@ -0,0 +1,46 @@
+# CPUバウンドな処理のファンアウト
+#
+# GILのあるCPythonでは, スレッドを増やしてもfactorizeやsimulateは速くならない(項目53).
+# free-threadedなビルド(3.13t以降)ではGILが無効になり, スレッドでもCPUを並列に使える.
+# 実行時にsys._is_gil_enabled()を調べて,
+#   - GILが無効: 普通のスレッド(ThreadPoolExecutor)で実行する
+#   - GILが有効: bootstrap.workerのワーカープロセスで実行する(Exampleのコードは再実行されない).
+#     ワーカープロセスは起動したまま次の呼び出しでも使い回す
+# を切り替える.
+
+import sys
+import types
+
+def gil_enabled():
+    # 3.12以前にはsys._is_gil_enabledが無い(常にGILがある)
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    if is_gil_enabled is None:
+        return True
+    return is_gil_enabled()
+
+def parallel_mode():
+    return 'processes' if gil_enabled() else 'threads'
+
+def call(function, args):
+    result = function(*args)
+    if isinstance(result, types.GeneratorType):
+        result = list(result) # ワーカープロセスと同じく, ジェネレータは最後まで回して返す
+    return result
+
+def parallel_map(function, *iterables, max_workers=None, mode=None):
+    # functionはスクリプトのトップレベルで定義された関数で, 引数と結果はpickleできること
+    if mode is None:
+        mode = parallel_mode()
+    all_args = list(zip(*iterables))
+
+    if mode == 'threads':
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda args: call(function, args), all_args))
+
+    import os
+    from bootstrap.worker import worker_pool
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    path = os.path.abspath(sys.modules[function.__module__].__file__)
+    return worker_pool().map(path, function.__name__, all_args, max_workers)
@@ -0,0 +1,292 @@
+# サブインタプリタでCPUバウンドな処理を並列に実行する
+#
+# プロセス(bootstrap.worker)ならGILの問題は無いが, ワーカーごとにメモリと起動時間がかかる.
+# スレッドはGILがあると並列に走らない. 3.12以降のサブインタプリタはそれぞれが自分のGILを持つので,
+# 1つのプロセスの中でも並列に走る(3.11ではGILを共有するので並列にはならないが動く).
+#
+# 標準ライブラリのサブインタプリタのAPIはバージョンごとに違うので, その違いはBackendで吸収する.
+#   3.14以降:  concurrent.interpreters (PEP 734) とそのQueue
+#   3.13:      _interpreters と _interpchannels
+#   3.12:      _xxsubinterpreters と _xxinterpchannels
+#   3.11:      _xxsubinterpreters (チャネルも同じモジュール)
+# どれも無ければavailable()がFalseになり, interpreter_mapはワーカープロセスにフォールバックする.
+#
+# 引数と結果はpickleしたbytesにしてチャネル(キュー)で受け渡す.
+# 関数はスクリプトのトップレベルで定義されたもので, サブインタプリタの中では
+# bootstrap.worker.load_definitionsでそのスクリプトの定義だけを読み込む.
+
+import os
+import pickle
+import sys
+import threading
+from concurrent.futures import Executor, Future
+from queue import SimpleQueue
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# サブインタプリタ側で一度だけ実行する準備. channel_recv/channel_sendはBackendごとに定義する
+SETUP_CODE = '''
+import pickle
+import sys
+if {package_dir!r} not in sys.path:
+    sys.path.insert(0, {package_dir!r})
+from bootstrap.worker import load_definitions, run_function
+modules = {{}}
+'''
+
+# 仕事1つごとに実行する
+RUN_CODE = '''
+path, function_name, args = pickle.loads(channel_recv(channel))
+try:
+    if (path, function_name) not in modules:
+        modules[path, function_name] = load_definitions(path, names=[function_name])
+    payload = (True, run_function(modules[path, function_name], function_name, args))
+except Exception as e:
+    payload = (False, e)
+channel_send(channel, pickle.dumps(payload))
+'''
+
+class PublicBackend:
+    # 3.14以降
+    name = 'concurrent.interpreters'
+    CHANNEL_CODE = '''
+def channel_recv(channel):
+    return channel.get()
+
+def channel_send(channel, data):
+    channel.put(data)
+'''
+
+    def __init__(self, interpreters):
+        self.interpreters = interpreters
+
+    def create(self):
+        return self.interpreters.create()
+
+    def destroy(self, interp):
+        interp.close()
+
+    def run(self, interp, code, channel):
+        interp.prepare_main(channel=channel)
+        interp.exec(code) # 失敗するとExecutionFailedが送出される
+
+    def create_channel(self):
+        return self.interpreters.create_queue()
+
+    def destroy_channel(self, channel):
+        pass
+
+    def send(self, channel, data):
+        channel.put(data)
+
+    def recv(self, channel):
+        return channel.get()
+
+class Backend313:
+    name = '_interpreters'
+    UNBOUND_REMOVE = 1 # インタプリタが破棄されたら, 送ったデータもチャネルから消す
+    CHANNEL_CODE = '''
+import _interpchannels
+
+def channel_recv(channel):
+    data, _ = _interpchannels.recv(channel)
+    return data
+
+def channel_send(channel, data):
+    _interpchannels.send(channel, data, blocking=False)
+'''
+
+    def __init__(self, interpreters, channels):
+        self.interpreters = interpreters
+        self.channels = channels
+
+    def create(self):
+        return self.interpreters.create()
+
+    def destroy(self, interp):
+        self.interpreters.destroy(interp)
+
+    def run(self, interp, code, channel):
+        # 3.13のexecは例外を送出せず, 失敗の情報を返す
+        error = self.interpreters.exec(interp, code, shared={'channel': channel})
+        if error is not None:
+            raise RuntimeError(f'Subinterpreter failed: {error.formatted}')
+
+    def create_channel(self):
+        return self.channels.create(self.UNBOUND_REMOVE)
+
+    def destroy_channel(self, channel):
+        self.channels.destroy(channel)
+
+    def send(self, channel, data):
+        self.channels.send(channel, data, blocking=False)
+
+    def recv(self, channel):
+        data, _ = self.channels.recv(channel)
+        return data
+
+class Backend312:
+    name = '_xxsubinterpreters'
+    CHANNEL_CODE = '''
+import _xxinterpchannels
+
+channel_recv = _xxinterpchannels.recv
+channel_send = _xxinterpchannels.send
+'''
+
+    def __init__(self, interpreters, channels):
+        self.interpreters = interpreters
+        self.channels = channels
+
+    def create(self):
+        return self.interpreters.create()
+
+    def destroy(self, interp):
+        self.interpreters.destroy(interp)
+
+    def run(self, interp, code, channel):
+        self.interpreters.run_string(interp, code, shared={'channel': channel})
+
+    def create_channel(self):
+        return self.channels.create()
+
+    def destroy_channel(self, channel):
+        self.channels.destroy(channel)
+
+    def send(self, channel, data):
+        self.channels.send(channel, data)
+
+    def recv(self, channel):
+        return self.channels.recv(channel)
+
+class Backend311(Backend312):
+    # チャネルの関数も_xxsubinterpretersにある
+    CHANNEL_CODE = '''
+import _xxsubinterpreters
+
+channel_recv = _xxsubinterpreters.channel_recv
+channel_send = _xxsubinterpreters.channel_send
+'''
+
+    def __init__(self, interpreters):
+        super().__init__(interpreters, None)
+
+    def create_channel(self):
+        return self.interpreters.channel_create()
+
+    def destroy_channel(self, channel):
+        self.interpreters.channel_destroy(channel)
+
+    def send(self, channel, data):
+        self.interpreters.channel_send(channel, data)
+
+    def recv(self, channel):
+        return self.interpreters.channel_recv(channel)
+
+def load_backend():
+    try:
+        from concurrent import interpreters
+    except ImportError:
+        pass
+    else:
+        return PublicBackend(interpreters)
+
+    try:
+        import _interpreters
+        import _interpchannels
+    except ImportError:
+        pass
+    else:
+        return Backend313(_interpreters, _interpchannels)
+
+    try:
+        import _xxsubinterpreters
+    except ImportError:
+        return None
+    try:
+        import _xxinterpchannels
+    except ImportError:
+        if hasattr(_xxsubinterpreters, 'channel_create'):
+            return Backend311(_xxsubinterpreters)
+        return None
+    return Backend312(_xxsubinterpreters, _xxinterpchannels)
+
+BACKEND = load_backend()
+
+def available():
+    return BACKEND is not None
+
+class SubinterpreterExecutor(Executor):
+    def __init__(self, max_workers=None):
+        if BACKEND is None:
+            raise RuntimeError('Subinterpreters are not available')
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.jobs = SimpleQueue()
+        self.shutdown_lock = threading.Lock()
+        self.is_shutdown = False
+        self.threads = []
+        # インタプリタの作成と準備は, 以降それを使うスレッドではなくここで済ませる
+        # (起動にかかる時間をコンストラクタに寄せて測れるようにする)
+        for _ in range(max_workers):
+            interp = BACKEND.create()
+            channel = BACKEND.create_channel()
+            setup = SETUP_CODE.format(package_dir=PACKAGE_DIR) + BACKEND.CHANNEL_CODE
+            BACKEND.run(interp, setup, channel)
+            thread = threading.Thread(target=self.run, args=(interp, channel),
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, fn, /, *args, **kwargs):
+        if kwargs:
+            raise TypeError('Keyword arguments are not supported')
+        path = sys.modules[fn.__module__].__file__
+        future = Future()
+        with self.shutdown_lock:
+            if self.is_shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            self.jobs.put((future, pickle.dumps((path, fn.__name__, args))))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.shutdown_lock:
+            self.is_shutdown = True
+        if cancel_futures:
+            while not self.jobs.empty():
+                future, _ = self.jobs.get()
+                future.cancel()
+        for _ in self.threads:
+            self.jobs.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def run(self, interp, channel):
+        try:
+            while (job := self.jobs.get()) is not None:
+                future, payload = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    BACKEND.send(channel, payload)
+                    BACKEND.run(interp, RUN_CODE, channel)
+                    ok, value = pickle.loads(BACKEND.recv(channel))
+                except BaseException as e:
+                    future.set_exception(e)
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        finally:
+            BACKEND.destroy_channel(channel)
+            BACKEND.destroy(interp)
+
+def interpreter_map(function, *iterables, max_workers=None):
+    if not available():
+        from bootstrap.parallel import parallel_map
+        return parallel_map(function, *iterables,
+                            max_workers=max_workers, mode='processes')
+    with SubinterpreterExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, *iterables))
@@ -0,0 +1,363 @@
+# 例のコードを実行せずに, スクリプトの関数をワーカープロセスで動かす
+#
+# multiprocessingのspawnは子プロセスで__main__のスクリプトをimportし直すので,
+# 第7章のスクリプトではExampleのコード(sleepやベンチマーク)がワーカーごとに毎回走ってしまう.
+# load_definitionsはスクリプトをastで読み, import, 関数, クラス, リテラルの代入だけを実行する.
+# FILE_HEADER = struct.Struct(...) のような計算する代入は, 関数やクラスがその名前を使っていて,
+# 右辺がそれより前に残したものだけで計算できるなら実行する(symtableで名前の依存をたどる).
+# ワーカーは呼び出す関数から依存をたどるので, 他の関数だけが使うExampleのオブジェクトは作らない.
+# 関数を指定しないときは, importしたものを呼ぶだけの右辺しか実行しない
+# (multiplexer = WaitMultiplexer() のようにスレッドやソケットを作るExampleのオブジェクトは作らない).
+# start_workerは `python -m bootstrap.worker` を起動し, 引数と結果をpickleでパイプに流す.
+# WorkerPoolは `python -m bootstrap.worker --serve` を起動したまま何度も使い回す
+# (スクリプトを読み込むのは関数ごとに最初の1回だけ).
+
+import ast
+import builtins
+import os
+import symtable
+import sys
+import types
+
+DEFINITION_NODES = (
+    ast.Import,
+    ast.ImportFrom,
+    ast.FunctionDef,
+    ast.AsyncFunctionDef,
+    ast.ClassDef,
+)
+
+def is_definition(node):
+    if isinstance(node, DEFINITION_NODES):
+        return True
+    if isinstance(node, ast.Try):
+        # try: import ... except ImportError: のようなオプションの依存だけを残す
+        return all(is_definition(child) for child in node.body)
+    if isinstance(node, (ast.Assign, ast.AnnAssign)) and node.value is not None:
+        try:
+            ast.literal_eval(node.value) # ALIVE = '*' のような定数
+        except ValueError:
+            return False
+        return True
+    return False
+
+def bound_names(node):
+    # トップレベルの文がモジュールに定義する名前
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return {(alias.asname or alias.name).split('.')[0] for alias in node.names}
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {node.name}
+    if isinstance(node, ast.Try):
+        return set().union(*(bound_names(child) for child in node.body))
+    if isinstance(node, ast.Assign):
+        targets = node.targets
+    elif isinstance(node, ast.AnnAssign):
+        targets = [node.target]
+    else:
+        return set()
+    names = set()
+    for target in targets:
+        elements = target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target]
+        if not all(isinstance(element, ast.Name) for element in elements):
+            return set() # obj.attr = ... や d[key] = ... は残さない
+        names.update(element.id for element in elements)
+    return names
+
+def loaded_names(*nodes):
+    return {child.id for node in nodes for child in ast.walk(node)
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load)}
+
+def global_references(table):
+    # 関数やクラスの中(入れ子も含む)から参照されるグローバルな名前
+    names = {symbol.get_name() for symbol in table.get_symbols()
+             if symbol.is_global() and symbol.is_referenced()}
+    for child in table.get_children():
+        names |= global_references(child)
+    return names
+
+DEFINITION_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+CONSTRUCTING_NODES = (
+    ast.ListComp,
+    ast.SetComp,
+    ast.DictComp,
+    ast.GeneratorExp,
+    ast.Lambda,
+    ast.NamedExpr,
+)
+
+def calls_only_imports(value, imported):
+    # struct.Struct('!I') や namedtuple(...) のようにimportしたものを呼ぶだけの右辺か
+    for child in ast.walk(value):
+        if isinstance(child, CONSTRUCTING_NODES):
+            return False
+        if isinstance(child, ast.Call):
+            func = child.func
+            while isinstance(func, ast.Attribute):
+                func = func.value
+            if not (isinstance(func, ast.Name) and func.id in imported):
+                return False
+    return True
+
+def select_definitions(source, path, names=None):
+    # namesを指定すると, その関数(とそこから使われるもの)が必要とする代入だけを残す.
+    # 指定しなければ, 全ての関数とクラスが必要とする代入のうち, importしたものを呼ぶだけのものを残す
+    tree = ast.parse(source, filename=path)
+    scopes = {child.get_lineno(): child for child in
+              symtable.symtable(source, path, 'exec').get_children()}
+
+    def references(node):
+        # 文を実行する(関数なら呼び出す)ときに使うグローバルな名前
+        if isinstance(node, ast.ClassDef):
+            return (loaded_names(*node.decorator_list, *node.bases, *node.keywords) |
+                    global_references(scopes[node.lineno]))
+        if isinstance(node, DEFINITION_SCOPES):
+            # デコレータ, 引数のデフォルト値などはdefを実行したときに評価される
+            return (loaded_names(*node.decorator_list, node.args) |
+                    global_references(scopes[node.lineno]))
+        return loaded_names(node.value)
+
+    kept = [node for node in tree.body if is_definition(node)]
+    definitions = [node for node in kept if isinstance(node, DEFINITION_SCOPES)]
+    if names is None:
+        needed = set(bound_names(node).pop() for node in definitions)
+    else:
+        needed = set(names)
+    imported = set().union(*(bound_names(node) for node in kept
+                             if isinstance(node, (ast.Import, ast.ImportFrom, ast.Try))))
+    candidates = [node for node in tree.body
+                  if not is_definition(node) and bound_names(node)]
+
+    def bound_before(lineno):
+        # 代入を実行する時点で定義されている名前
+        return set(dir(builtins)).union(
+            *(bound_names(node) for node in kept if node.lineno < lineno))
+
+    expanded = []
+    changed = True
+    while changed:
+        changed = False
+        for node in definitions + candidates:
+            if node in expanded or not (bound_names(node) & needed):
+                continue
+            dependencies = references(node)
+            if not dependencies <= needed:
+                needed |= dependencies # それが使う代入も探す
+                changed = True
+            if node in definitions:
+                expanded.append(node)
+            elif (dependencies <= bound_before(node.lineno) and
+                  (names is not None or calls_only_imports(node.value, imported))):
+                kept.append(node)
+                expanded.append(node)
+                changed = True
+
+    available = set(dir(builtins)).union(*(bound_names(node) for node in kept))
+    assigned = {child.id for node in tree.body for child in ast.walk(node)
+                if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store)}
+    skipped = sorted((needed & assigned) - available)
+    tree.body = [node for node in tree.body if node in kept]
+    return tree, skipped
+
+def load_definitions(path, module_name=None, names=None):
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    tree, skipped = select_definitions(source, path, names)
+
+    if module_name is None:
+        module_name = os.path.splitext(os.path.basename(path))[0]
+    module = types.ModuleType(module_name)
+    module.__file__ = path
+    # 関数が使っているのに読み込めなかった(Exampleのコードに依存する)グローバルな名前
+    module.__skipped_globals__ = skipped
+    # 同じ名前で登録しておくとクラスのインスタンスもpickleできる
+    sys.modules[module_name] = module
+    exec(compile(tree, path, 'exec'), module.__dict__)
+    return module
+
+class WorkerHandle:
+    def __init__(self, proc):
+        self.proc = proc
+
+    def result(self, timeout=None):
+        out, _ = self.proc.communicate(timeout=timeout)
+        if self.proc.returncode != 0:
+            raise RuntimeError(f'Worker exited with {self.proc.returncode}')
+        import pickle # load_definitionsだけを使う側ではimportしない
+        ok, value = pickle.loads(out)
+        if not ok:
+            raise value
+        return value
+
+def run_function(module, function_name, args):
+    try:
+        result = getattr(module, function_name)(*args)
+    except NameError as e:
+        skipped = getattr(module, '__skipped_globals__', [])
+        if e.name not in skipped:
+            raise
+        raise NameError(
+            f'{e}: {e.name!r} is assigned by example code that '
+            f'load_definitions does not run (skipped globals: {skipped})',
+            name=e.name) from e
+    if isinstance(result, types.GeneratorType):
+        result = list(result) # ジェネレータはpickleできない
+    return result
+
+def spawn_worker(*options):
+    import subprocess # ワーカー側では使わないのでここでimportする
+
+    env = os.environ.copy()
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [package_dir, env.get('PYTHONPATH')]))
+    return subprocess.Popen(
+        [sys.executable, '-m', 'bootstrap.worker', *options],
+        env=env,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+def start_worker(path, function_name, *args):
+    import pickle
+    proc = spawn_worker()
+    payload = (os.path.abspath(path), function_name, args)
+    proc.stdin.write(pickle.dumps(payload))
+    proc.stdin.close()
+    proc.stdin = None
+    return WorkerHandle(proc)
+
+class PersistentWorker:
+    def __init__(self):
+        self.proc = spawn_worker('--serve')
+
+    def call(self, path, function_name, args):
+        import pickle
+        try:
+            pickle.dump((path, function_name, args), self.proc.stdin)
+            self.proc.stdin.flush()
+            ok, value = pickle.load(self.proc.stdout)
+        except (EOFError, OSError):
+            raise RuntimeError(f'Worker exited with {self.proc.wait()}') from None
+        if not ok:
+            raise value
+        return value
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        self.proc.stdin.close() # EOFでserveが終わる
+        self.proc.wait()
+        self.proc.stdout.close()
+
+class WorkerPool:
+    # worker.pyはサブインタプリタでもimportされ, 3.11ではthreadingをimportした
+    # サブインタプリタを破棄できなくなるので, threadingとqueueはここでimportする
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.idle = [] # 今は誰も使っていないワーカー
+
+    def acquire(self, count):
+        # 同時に呼ばれても同じワーカーを2人に渡さない. 足りなければ起動する
+        with self.lock:
+            workers = [worker for worker in self.idle[:count] if worker.alive()]
+            del self.idle[:count]
+        while len(workers) < count:
+            workers.append(PersistentWorker())
+        return workers
+
+    def release(self, workers):
+        with self.lock:
+            self.idle.extend(worker for worker in workers if worker.alive())
+
+    def map(self, path, function_name, all_args, max_workers):
+        import threading
+        from queue import Empty, SimpleQueue
+
+        jobs = SimpleQueue()
+        for job in enumerate(all_args):
+            jobs.put(job)
+        results = [None] * len(all_args)
+        errors = {}
+
+        def run(worker):
+            # パイプを待つ間はGILを放すので, ワーカーごとにスレッドを1つ使う
+            while True:
+                try:
+                    index, args = jobs.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[index] = worker.call(path, function_name, args)
+                except Exception as e:
+                    errors[index] = e
+
+        workers = self.acquire(min(max_workers, len(all_args)))
+        threads = [threading.Thread(target=run, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.release(workers)
+        if errors:
+            raise errors[min(errors)]
+        return results
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for worker in idle:
+            worker.close()
+
+POOL = None
+
+def worker_pool():
+    global POOL
+    if POOL is None:
+        import atexit
+        POOL = WorkerPool()
+        atexit.register(POOL.close)
+    return POOL
+
+def serve():
+    # 仕事を1つずつ受け取り, 結果を返す. 読み込んだスクリプトは関数ごとに覚えておく
+    import pickle
+    input = sys.stdin.buffer
+    output = sys.stdout.buffer
+    sys.stdout = sys.stderr
+    modules = {}
+    while True:
+        try:
+            path, function_name, args = pickle.load(input)
+        except EOFError:
+            return
+        try:
+            if (path, function_name) not in modules:
+                modules[path, function_name] = load_definitions(
+                    path, names=[function_name])
+            payload = (True, run_function(modules[path, function_name],
+                                          function_name, args))
+        except Exception as e:
+            payload = (False, e)
+        pickle.dump(payload, output)
+        output.flush()
+
+def main():
+    if sys.argv[1:] == ['--serve']:
+        serve()
+        return
+    import pickle
+    path, function_name, args = pickle.load(sys.stdin.buffer)
+    output = sys.stdout.buffer
+    sys.stdout = sys.stderr # 結果を流すパイプにprintが混ざらないようにする
+    try:
+        module = load_definitions(path, names=[function_name])
+        payload = (True, run_function(module, function_name, args))
+    except Exception as e:
+        payload = (False, e)
+    output.write(pickle.dumps(payload))
+    output.flush()
+
+if __name__ == '__main__':
+    main()
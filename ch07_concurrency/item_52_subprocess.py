@@ -2,35 +2,12 @@
 # 1. 一回限りの子プロセス実行には, run()メソッドを使う
 # 2. Popenクラスを用いると, メインプロセスで他のタスクを実行しながら子プロセスを定期的にポーリングしてチェックできる
 
-import random
-random.seed(1234)
-
-import logging
-from pprint import pprint
-from sys import stdout as STDOUT
-
-# Write all output to a temporary directory
-import atexit
-import gc
-import io
-import os
-import tempfile
-
-TEST_DIR = tempfile.TemporaryDirectory()
-atexit.register(TEST_DIR.cleanup)
-
-# Make sure Windows processes exit cleanly
-OLD_CWD = os.getcwd()
-atexit.register(lambda: os.chdir(OLD_CWD))
-os.chdir(TEST_DIR.name)
-
-def close_open_files():
-    everything = gc.get_objects()
-    for obj in everything:
-        if isinstance(obj, io.IOBase):
-            obj.close()
-
-atexit.register(close_open_files)
+# Write all output to a temporary directory and
+# close files left open at exit.
+# random(seed=1234), logging, pprint, STDOUTは `from bootstrap import random` のように
+# 使う時に取り出す(その時に初めてimportされる)
+from bootstrap import setup_environment
+setup_environment()
 
 # Example 1
 import subprocess
@@ -162,3 +139,255 @@ print('Exit status', proc.poll())
 
 
 
+# Example 12
+# 小さいデータではopensslのプロセス生成とパイプI/Oが処理時間の大半を占める.
+# run_encrypt/run_hashの裏側をバックエンドとして差し替えられるようにする.
+# - InProcessCryptoBackend: hashlib(ダイジェスト)とcryptography(暗号, 入っていれば)をプロセス内で使う
+# - SubprocessCryptoBackend: 従来通りopenssl CLIを起動する(whirlpoolなどプロセス内にないアルゴリズム用)
+import hashlib
+import io
+import stat
+
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    try:
+        from cryptography.hazmat.decrepit.ciphers.algorithms import TripleDES
+    except ImportError:
+        TripleDES = algorithms.TripleDES
+except ImportError:
+    Cipher = None
+
+PASSWORD = 'zf7ShyBhZOraQDdE/FiZpm/m/8f9X+M1'
+
+class InProcessResult:
+    '''Popenのstdout/communicate()/returncodeだけを真似たプロセス内の実行結果'''
+    def __init__(self, output):
+        self.stdout = io.BytesIO(output)
+        self.returncode = 0
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def communicate(self, timeout=None):
+        out = None
+        if self.stdout is not None:
+            out = self.stdout.read()
+        return out, None
+
+def read_input(input_stdin):
+    # bytes, ファイルライクオブジェクト(パイプやInProcessResult.stdout)のどちらも受け付ける
+    if isinstance(input_stdin, (bytes, bytearray, memoryview)):
+        return bytes(input_stdin)
+    return input_stdin.read()
+
+def input_fileno(input_stdin):
+    # OSのファイル記述子を持つ(パイプやファイル)ならそれを, 持たない(bytesやBytesIO)ならNoneを返す
+    try:
+        return input_stdin.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+
+class SubprocessCryptoBackend:
+    name = 'subprocess'
+
+    def supports_cipher(self, cipher):
+        return True
+
+    def supports_digest(self, algorithm):
+        return True
+
+    def encrypt(self, data, cipher='des3', password=PASSWORD):
+        env = os.environ.copy()
+        env['password'] = password
+        proc = subprocess.Popen(
+            ['openssl', 'enc', f'-{cipher}', '-pass', 'env:password'],
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        proc.stdin.write(data)
+        proc.stdin.flush()
+        return proc
+
+    def hash(self, input_stdin, algorithm='whirlpool'):
+        command = ['openssl', 'dgst', f'-{algorithm}', '-binary']
+        if input_fileno(input_stdin) is not None:
+            return subprocess.Popen(
+                command,
+                stdin=input_stdin,
+                stdout=subprocess.PIPE
+            )
+        # bytesやInProcessResult.stdout(BytesIO)はPopenのstdinに渡せないので,
+        # 読み出して子プロセスのstdinに書き込む
+        proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        proc.stdin.write(read_input(input_stdin))
+        proc.stdin.close() # EOFを送らないとdgstは終わらない
+        proc.stdin = None
+        return proc
+
+class InProcessCryptoBackend:
+    name = 'inprocess'
+
+    # openssl encの暗号名 -> (アルゴリズム, 鍵長, IV長)
+    CIPHERS = {}
+    if Cipher is not None:
+        CIPHERS = {
+            'des3': (TripleDES, 24, 8),
+            'aes-128-cbc': (algorithms.AES, 16, 16),
+            'aes-256-cbc': (algorithms.AES, 32, 16),
+        }
+
+    def supports_cipher(self, cipher):
+        return cipher in self.CIPHERS
+
+    def supports_digest(self, algorithm):
+        return algorithm in hashlib.algorithms_available
+
+    def encrypt(self, data, cipher='des3', password=PASSWORD):
+        # `openssl enc -pass` と同じ出力形式: b'Salted__' + salt + 暗号文
+        # 鍵とIVはopenssl 1.1.0以降のデフォルトと同じくEVP_BytesToKey(sha256, 1回)で導出する
+        algorithm, key_len, iv_len = self.CIPHERS[cipher]
+        salt = os.urandom(8)
+        derived = b''
+        block = b''
+        while len(derived) < key_len + iv_len:
+            block = hashlib.sha256(block + password.encode() + salt).digest()
+            derived += block
+        key, iv = derived[:key_len], derived[key_len:key_len + iv_len]
+
+        padder = padding.PKCS7(iv_len * 8).padder()
+        encryptor = Cipher(algorithm(key), modes.CBC(iv)).encryptor()
+        padded = padder.update(data) + padder.finalize()
+        encrypted = encryptor.update(padded) + encryptor.finalize()
+        return InProcessResult(b'Salted__' + salt + encrypted)
+
+    def hash(self, input_stdin, algorithm='whirlpool'):
+        # 動いている子プロセスのパイプをEOFまで読むと, その子のstdinが閉じられるまで
+        # (多くの場合いつまでも)ブロックするので受け付けない
+        fd = input_fileno(input_stdin)
+        if fd is not None and stat.S_ISFIFO(os.fstat(fd).st_mode):
+            raise ValueError('Cannot hash a pipe in process; '
+                             'use SUBPROCESS_BACKEND for pipelines of child processes')
+        digest = hashlib.new(algorithm, read_input(input_stdin)).digest()
+        return InProcessResult(digest)
+
+SUBPROCESS_BACKEND = SubprocessCryptoBackend()
+INPROCESS_BACKEND = InProcessCryptoBackend()
+
+# Example 13
+# backend=Noneならプロセス内で扱えるものはプロセス内で, 無理ならopensslにフォールバックする.
+# 呼び出しごとにbackend=SUBPROCESS_BACKENDのように明示的に選ぶこともできる.
+def run_encrypt(data, cipher='des3', backend=None):
+    if backend is None:
+        if INPROCESS_BACKEND.supports_cipher(cipher):
+            backend = INPROCESS_BACKEND
+        else:
+            backend = SUBPROCESS_BACKEND
+    return backend.encrypt(data, cipher=cipher)
+
+# 子プロセスのパイプはEOFまで読むと呼び出し側がブロックするので, 自動選択ではopensslにつなぐ
+def run_hash(input_stdin, algorithm='whirlpool', backend=None):
+    if backend is None:
+        in_memory = isinstance(input_stdin, (bytes, bytearray, memoryview, io.BytesIO))
+        if in_memory and INPROCESS_BACKEND.supports_digest(algorithm):
+            backend = INPROCESS_BACKEND
+        else:
+            backend = SUBPROCESS_BACKEND
+    return backend.hash(input_stdin, algorithm=algorithm)
+
+# Example 14
+# Example 9と同じパイプライン. バックエンドが違ってもcommunicate()/returncodeで同じように扱える
+# (None: 自動選択. cryptographyが無ければ暗号化だけopensslにフォールバックする)
+for backend in (None, SUBPROCESS_BACKEND):
+    encrypt_procs = []
+    hash_procs = []
+    for _ in range(3):
+        data = os.urandom(100)
+
+        encrypt_proc = run_encrypt(data, backend=backend)
+        encrypt_procs.append(encrypt_proc)
+
+        hash_proc = run_hash(encrypt_proc.stdout, algorithm='sha256', backend=backend)
+        hash_procs.append(hash_proc)
+
+        encrypt_proc.stdout.close()
+        encrypt_proc.stdout = None
+
+    for proc in encrypt_procs:
+        proc.communicate()
+        assert proc.returncode == 0
+
+    for proc in hash_procs:
+        out, _ = proc.communicate()
+        print(getattr(backend, 'name', 'auto'), out[-10:])
+        assert proc.returncode == 0, f"Return code: {proc.returncode}"
+
+# バックエンドを混ぜたパイプライン. プロセス内の結果(BytesIO)はopensslのstdinに書き込まれる
+# (cryptographyがあればrun_encryptの自動選択はプロセス内になる)
+data = os.urandom(100)
+encrypt_proc = run_encrypt(data)
+hash_proc = run_hash(encrypt_proc.stdout, algorithm='sha256', backend=SUBPROCESS_BACKEND)
+encrypt_proc.communicate()
+out, _ = hash_proc.communicate()
+assert encrypt_proc.returncode == 0 and hash_proc.returncode == 0
+print('mixed', out[-10:])
+
+first_proc = run_hash(data, algorithm='sha256', backend=INPROCESS_BACKEND)
+second_proc = run_hash(first_proc.stdout, algorithm='sha256', backend=SUBPROCESS_BACKEND)
+out, _ = second_proc.communicate()
+assert out == hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+# 逆向き(opensslのパイプをプロセス内で読む)は, ブロックする代わりにエラーになる
+encrypt_proc = run_encrypt(data, backend=SUBPROCESS_BACKEND)
+try:
+    run_hash(encrypt_proc.stdout, algorithm='sha256', backend=INPROCESS_BACKEND)
+except ValueError as e:
+    print(f'Error: {e}')
+else:
+    assert False
+encrypt_proc.communicate()
+
+# 同じ入力なら, どちらのバックエンドでも同じダイジェストになる
+data = os.urandom(1000)
+in_process, _ = run_hash(data, algorithm='sha256', backend=INPROCESS_BACKEND).communicate()
+out_process, _ = run_hash(data, algorithm='sha256', backend=SUBPROCESS_BACKEND).communicate()
+assert in_process == out_process
+
+# whirlpoolはhashlibにない(ことが多い)のでopensslにフォールバックする
+print('whirlpool backend:',
+      'inprocess' if INPROCESS_BACKEND.supports_digest('whirlpool') else 'subprocess')
+
+# Example 15
+# ベンチマーク: 同時にjobs個のハッシュを計算するとき, 何バイトからサブプロセスが得になるか.
+# プロセス内は1コアで逐次処理, サブプロセスは並列に走るがプロセス生成のコストを払う.
+def benchmark_hash(size, backend, jobs=4):
+    payloads = [os.urandom(size) for _ in range(jobs)]
+    start = time.time()
+    procs = [run_hash(data, algorithm='sha256', backend=backend) for data in payloads]
+    for proc in procs:
+        proc.communicate()
+    return time.time() - start
+
+crossover = None
+for exponent in range(4, 25, 2):
+    size = 2 ** exponent
+    in_delta = benchmark_hash(size, INPROCESS_BACKEND)
+    sub_delta = benchmark_hash(size, SUBPROCESS_BACKEND)
+    print(f'{size:>10} bytes: inprocess {in_delta:.4f} [s], '
+          f'subprocess {sub_delta:.4f} [s]')
+    if crossover is None and sub_delta < in_delta:
+        crossover = size
+
+if crossover is None:
+    print(f'Subprocess never won up to {size} bytes '
+          f'({os.cpu_count()} CPUs)')
+else:
+    print(f'Subprocess wins from {crossover} bytes')
@@ -1,33 +1,10 @@
 # Reproduce book environment
-import random
-random.seed(1234)
-
-import logging
-from pprint import pprint
-from sys import stdout as STDOUT
-
-# Write all output to a temporary directory
-import atexit
-import gc
-import io
-import os
-import tempfile
-
-TEST_DIR = tempfile.TemporaryDirectory()
-atexit.register(TEST_DIR.cleanup)
-
-# Make sure Windows processes exit cleanly
-OLD_CWD = os.getcwd()
-atexit.register(lambda: os.chdir(OLD_CWD))
-os.chdir(TEST_DIR.name)
-
-def close_open_files():
-    everything = gc.get_objects()
-    for obj in everything:
-        if isinstance(obj, io.IOBase):
-            obj.close()
-
-atexit.register(close_open_files)
+# Write all output to a temporary directory and
+# close files left open at exit.
+# random(seed=1234), logging, pprint, STDOUTは `from bootstrap import random` のように
+# 使う時に取り出す(その時に初めてimportされる)
+from bootstrap import setup_environment
+setup_environment()
 
 # Example 1
 def factorize(number):
@@ -108,3 +85,489 @@ for thread in threads:
 end = time.time()
 delta = end - start
 print(f'Took {delta:.3f} seconds')
+
+# Example 10
+# 1回のslow_systemcallに1スレッドだと, 10k回ではスレッドスタックを使い果たす.
+# selectors(epoll/kqueue)で多数のブロッキング待ちを1つのループスレッドに登録し,
+# 完了はFuture(add_done_callbackでコールバックも可)で受け取る.
+import heapq
+import selectors
+from concurrent.futures import Future
+from threading import Lock
+
+class WaitMultiplexer:
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = Lock()
+        self.requests = []  # 他スレッドから渡された(sock, deadline, future)
+        self.deadlines = [] # (deadline, 連番, sock, future)のヒープ
+        self.counter = 0
+        self.closed = False
+        # ループスレッドをselect()から起こすためのソケット
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, None)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def wait_readable(self, sock, timeout):
+        # select.select([sock], [], [], timeout)と同じ: 読み込み可能ならTrue, タイムアウトならFalse
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self.lock:
+            self.requests.append((sock, time.monotonic() + timeout, future))
+        self.wake_writer.send(b'\0')
+        return future
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.wake_writer.send(b'\0')
+        self.thread.join()
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+
+    def run(self):
+        while True:
+            with self.lock:
+                requests, self.requests = self.requests, []
+                closed = self.closed
+            for sock, deadline, future in requests:
+                self.selector.register(sock, selectors.EVENT_READ, future)
+                self.counter += 1
+                heapq.heappush(self.deadlines, (deadline, self.counter, sock, future))
+
+            if closed:
+                for key in list(self.selector.get_map().values()):
+                    if key.data is not None:
+                        self.selector.unregister(key.fileobj)
+                        key.data.set_result(False)
+                return
+
+            timeout = None
+            if self.deadlines:
+                timeout = max(0, self.deadlines[0][0] - time.monotonic())
+
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    self.wake_reader.recv(4096)
+                    continue
+                self.selector.unregister(key.fileobj)
+                key.data.set_result(True)
+
+            now = time.monotonic()
+            while self.deadlines and self.deadlines[0][0] <= now:
+                _, _, sock, future = heapq.heappop(self.deadlines)
+                if future.done():
+                    continue # 期限前に読み込み可能になって完了済み
+                self.selector.unregister(sock)
+                future.set_result(False)
+
+# Example 11
+# Linuxでは未接続のTCPソケットはすぐに読み込み可能(POLLHUP)になってしまうので,
+# データの届かないUDPソケットで本当に0.3秒ブロックさせる
+def blocking_socket():
+    return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+def slow_systemcall_async(multiplexer):
+    sock = blocking_socket()
+    future = multiplexer.wait_readable(sock, 0.3)
+    future.add_done_callback(lambda _: sock.close())
+    return future
+
+# Example 12
+# Example 8, 9と同じく, 待ちの間にメインスレッドで計算を進められる
+multiplexer = WaitMultiplexer()
+start = time.time()
+
+futures = []
+for _ in range(5):
+    futures.append(slow_systemcall_async(multiplexer))
+
+for i in range(5):
+    compute_helicopter_location(i)
+
+for future in futures:
+    future.result()
+
+end = time.time()
+delta = end - start
+print(f'Took {delta:.3f} seconds')
+
+# Example 13
+# ベンチマーク: 同時待ち数10, 1k, 10kでのメモリ(RSS)と遅延(最初の待ち開始から最後の完了まで)
+try:
+    import resource # Windowsには無い
+except ImportError:
+    resource = None
+
+# 10k個のソケットを開くのでファイルディスクリプタの上限を引き上げる.
+# macOSのハードリミットはRLIM_INFINITYだがそのままは設定できないので, 有限の値で抑える
+MAX_OPEN_FILES = 20000
+fd_limit = None # 不明(Windows)
+if resource is not None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        target = MAX_OPEN_FILES
+    else:
+        target = min(hard, MAX_OPEN_FILES)
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass # 引き上げられなければ10kの行を飛ばす
+    fd_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if fd_limit == resource.RLIM_INFINITY:
+        fd_limit = None
+
+def current_rss_kb(pid='self'):
+    # Linux以外では/proc/<pid>/statusが無いので0を返す
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def benchmark_threads(count):
+    finished = [0.0] * count
+
+    # select.select()はFD_SETSIZE(1024)を超えるfdを扱えないので, 使えるならpollで待つ
+    def target(index):
+        with blocking_socket() as sock:
+            if hasattr(select, 'poll'):
+                poller = select.poll()
+                poller.register(sock, select.POLLIN)
+                poller.poll(300)
+            else:
+                select.select([sock], [], [], 0.3)
+        finished[index] = time.monotonic()
+
+    before = current_rss_kb()
+    start = time.monotonic()
+    threads = []
+    try:
+        for i in range(count):
+            thread = Thread(target=target, args=(i,))
+            thread.start()
+            threads.append(thread)
+    except RuntimeError: # can't start new thread
+        pass
+    rss = current_rss_kb() - before
+    for thread in threads:
+        thread.join()
+    if len(threads) < count:
+        return None
+    return rss, max(finished) - start
+
+def benchmark_multiplexer(count):
+    finished = [0.0] * count
+
+    def make_callback(index):
+        def callback(_):
+            finished[index] = time.monotonic()
+        return callback
+
+    before = current_rss_kb()
+    start = time.monotonic()
+    futures = []
+    for i in range(count):
+        future = slow_systemcall_async(multiplexer)
+        future.add_done_callback(make_callback(i))
+        futures.append(future)
+    rss = current_rss_kb() - before
+    for future in futures:
+        future.result()
+    return rss, max(finished) - start
+
+for count in (10, 1000, 10000):
+    # 待ちごとにソケットを1つ開くので, 上限に収まらない同時待ち数は測らない
+    if fd_limit is not None and count + 100 > fd_limit:
+        print(f'{"skipped":>11} x {count:>5}: open file limit is {fd_limit}')
+        continue
+    for name, bench in (('threads', benchmark_threads),
+                        ('multiplexer', benchmark_multiplexer)):
+        try:
+            result = bench(count)
+        except OSError as e: # Too many open files
+            result = None
+            print(f'{name:>11} x {count:>5}: {e}')
+            continue
+        if result is None:
+            print(f'{name:>11} x {count:>5}: could not start threads')
+            continue
+        rss, latency = result
+        print(f'{name:>11} x {count:>5}: +{rss} KiB RSS, '
+              f'took {latency:.3f} seconds')
+
+multiplexer.close()
+
+# Example 14
+# 仕事の重さがばらつく(factorizeの数の大きさが違う)と, 固定の割り当てでは暇なスレッドが出る.
+# ワーカーごとにdequeを持ち, 自分の仕事は右端から(LIFO), 暇になったら他人の左端から盗む(work stealing).
+# concurrent.futures.Executorを継承するのでsubmit/map/withはThreadPoolExecutorと同じように使える.
+from collections import deque
+from bootstrap import random
+from concurrent.futures import Executor
+from threading import Semaphore, local
+
+class WorkStealingExecutor(Executor):
+    def __init__(self, max_workers):
+        self.deques = [deque() for _ in range(max_workers)]
+        self.tasks = Semaphore(0) # 未着手の仕事の数
+        self.shutdown_lock = Lock()
+        self.is_shutdown = False
+        self.next_index = 0
+        self.current = local() # ワーカースレッドなら自分の番号を持つ
+        self.steals = [0] * max_workers
+        self.idle_time = [0.0] * max_workers
+        self.rng = random.Random(1234)
+        self.threads = []
+        for index in range(max_workers):
+            thread = Thread(target=self.run, args=(index,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    @property
+    def steal_count(self):
+        return sum(self.steals)
+
+    @property
+    def total_idle_time(self):
+        return sum(self.idle_time)
+
+    def push(self, work_items):
+        # ワーカー内からのsubmitは自分のdequeへ, 外からは順番に配る
+        index = getattr(self.current, 'index', None)
+        with self.shutdown_lock:
+            if self.is_shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            for item in work_items:
+                if index is None:
+                    self.deques[self.next_index].append(item)
+                    self.next_index = (self.next_index + 1) % len(self.deques)
+                else:
+                    self.deques[index].append(item)
+        self.tasks.release(len(work_items))
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        self.push([(future, fn, args, kwargs)])
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        # まとめて配ってからセマフォを一度に解放する
+        work_items = [(Future(), fn, args, {}) for args in zip(*iterables)]
+        self.push(work_items)
+        futures = [future for future, _, _, _ in work_items]
+
+        def result_iterator():
+            try:
+                for future in futures:
+                    yield future.result(timeout)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return result_iterator()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.shutdown_lock:
+            self.is_shutdown = True
+        if cancel_futures:
+            for work in self.deques:
+                while True:
+                    try:
+                        future, _, _, _ = work.popleft()
+                    except IndexError:
+                        break
+                    future.cancel()
+        self.tasks.release(len(self.threads)) # 寝ているワーカーを起こす
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def find_work(self, index):
+        try:
+            return self.deques[index].pop()
+        except IndexError:
+            pass
+        victims = list(range(len(self.deques)))
+        self.rng.shuffle(victims)
+        for victim in victims:
+            if victim == index:
+                continue
+            try:
+                work_item = self.deques[victim].popleft()
+            except IndexError:
+                continue
+            self.steals[index] += 1
+            return work_item
+        return None
+
+    def run(self, index):
+        self.current.index = index
+        while True:
+            start = time.perf_counter()
+            self.tasks.acquire()
+            self.idle_time[index] += time.perf_counter() - start
+
+            # セマフォを取れたなら, どこかのdequeに自分の分の仕事が残っている
+            while (work_item := self.find_work(index)) is None:
+                if self.is_shutdown:
+                    return
+                time.sleep(0)
+
+            future, fn, args, kwargs = work_item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+# Example 15
+with WorkStealingExecutor(max_workers=4) as executor:
+    future = executor.submit(lambda number: list(factorize(number)), 120)
+    print(future.result())
+    print(list(executor.map(lambda number: len(list(factorize(number))), numbers)))
+
+# Example 16
+# ベンチマーク: Example 2のfactorize(重さがばらつく)とExample 11の低速システムコールを混ぜた仕事を
+# ThreadPoolExecutorと比べる. GILがあるのでCPUバウンド部分はどちらも並列にはならない.
+from concurrent.futures import ThreadPoolExecutor
+
+def factor_count(number):
+    return len(list(factorize(number)))
+
+def slow_wait():
+    with blocking_socket() as sock:
+        select.select([sock], [], [], 0.05)
+
+def mixed_job(number):
+    if number is None:
+        slow_wait()
+        return 0
+    return factor_count(number)
+
+# 小さい数がたくさん, 大きい数が少し, 合間にI/O待ち
+workload = [random.randint(1, 20000) for _ in range(400)]
+workload += numbers
+workload += [None] * 40
+random.shuffle(workload)
+
+def benchmark_executor(executor):
+    start = time.time()
+    with executor:
+        results = list(executor.map(mixed_job, workload))
+    return time.time() - start, results
+
+pool_delta, pool_results = benchmark_executor(ThreadPoolExecutor(max_workers=4))
+stealing = WorkStealingExecutor(max_workers=4)
+stealing_delta, stealing_results = benchmark_executor(stealing)
+assert pool_results == stealing_results
+
+print(f'ThreadPoolExecutor took {pool_delta:.3f} seconds')
+print(f'WorkStealingExecutor took {stealing_delta:.3f} seconds '
+      f'({stealing.steal_count} steals, '
+      f'{stealing.total_idle_time:.3f} seconds idle)')
+
+# Example 17
+# free-threadedなCPython(3.13t以降, sys._is_gil_enabled()がFalse)ならスレッドでもfactorizeが並列に走る.
+# parallel_mapはGILが無効ならスレッド, 有効ならワーカープロセスで実行する.
+# GILのあるビルドとfree-threadedなビルドの両方でこのスクリプトを実行して比べる:
+#   python ch07_concurrency/item_53_threading.py
+#   python3.13t ch07_concurrency/item_53_threading.py
+import sys
+from bootstrap import gil_enabled, parallel_map
+
+print(f'{sys.version.split()[0]}, GIL enabled: {gil_enabled()}')
+
+start = time.time()
+serial = [list(factorize(number)) for number in numbers]
+end = time.time()
+print(f'Serial took {end - start:.3f} seconds')
+
+for mode in ('threads', 'processes'):
+    start = time.time()
+    results = parallel_map(factorize, numbers, max_workers=len(numbers), mode=mode)
+    end = time.time()
+    assert results == serial
+    print(f'parallel_map with {mode} took {end - start:.3f} seconds')
+
+start = time.time()
+results = parallel_map(factorize, numbers, max_workers=len(numbers))
+end = time.time()
+assert results == serial
+print(f'parallel_map (auto) took {end - start:.3f} seconds')
+
+# Example 18
+# サブインタプリタ(3.12以降はそれぞれが自分のGILを持つ)でfactorizeを実行する.
+# プロセスより軽く, スレッドと違ってGILのあるビルドでも並列に走る.
+# スレッド, ワーカープロセス, サブインタプリタで起動の遅延, メモリ, スループットを比べる.
+from bootstrap import SubinterpreterExecutor, interpreter_map, subinterpreters_available
+from bootstrap import worker_pool
+
+print(f'Subinterpreters available: {subinterpreters_available()}')
+results = interpreter_map(factorize, numbers, max_workers=len(numbers))
+assert results == serial
+
+# それぞれ(準備ができた時刻, 結果, 増えたメモリ[KiB]のリスト)を返す.
+# スレッドとサブインタプリタは親プロセスのRSSの増分, プロセスはワーカーごとのRSS
+def run_threads(workers, jobs):
+    before = current_rss_kb()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        first = executor.submit(call_factorize, 1)
+        first.result()
+        ready = time.perf_counter()
+        results = list(executor.map(call_factorize, jobs))
+        memory = [current_rss_kb() - before]
+    return ready, results, memory
+
+def run_processes(workers, jobs):
+    # parallel_mapのワーカープロセスは使い回されるので, 前のExampleで起動したものを止めて
+    # 起動から測る. メモリは止める前に, 生きているワーカーの/proc/<pid>/statusから読む
+    pool = worker_pool()
+    pool.close()
+    parallel_map(factorize, [1] * workers, max_workers=workers, mode='processes')
+    ready = time.perf_counter()
+    results = parallel_map(factorize, jobs, max_workers=workers, mode='processes')
+    memory = [current_rss_kb(worker.proc.pid) for worker in pool.idle]
+    pool.close()
+    return ready, results, memory
+
+def run_subinterpreters(workers, jobs):
+    before = current_rss_kb()
+    with SubinterpreterExecutor(max_workers=workers) as executor:
+        executor.submit(factorize, 1).result()
+        ready = time.perf_counter()
+        results = list(executor.map(factorize, jobs))
+        memory = [current_rss_kb() - before]
+    return ready, results, memory
+
+def call_factorize(number):
+    return list(factorize(number))
+
+jobs = numbers * 2
+expected = [list(factorize(number)) for number in jobs]
+runners = [('threads', run_threads), ('processes', run_processes)]
+if subinterpreters_available():
+    runners.append(('subinterpreters', run_subinterpreters))
+
+for name, runner in runners:
+    start = time.perf_counter()
+    ready, results, memory = runner(4, jobs)
+    end = time.perf_counter()
+    assert results == expected
+    if name == 'processes':
+        memory = (f'{sum(memory)} KiB in {len(memory)} workers '
+                  f'({", ".join(map(str, memory))} KiB each)')
+    else:
+        memory = f'+{memory[0]} KiB'
+    print(f'{name:>15}: startup {ready - start:.3f} seconds, {memory}, '
+          f'{len(jobs) / (end - ready):.1f} jobs/second')
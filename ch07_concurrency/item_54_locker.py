@@ -4,35 +4,12 @@
 # 結果的に, データ競合は発生する
 
 # Reproduce book environment
-import random
-random.seed(1234)
-
-import logging
-from pprint import pprint
-from sys import stdout as STDOUT
-
-# Write all output to a temporary directory
-import atexit
-import gc
-import io
-import os
-import tempfile
-
-TEST_DIR = tempfile.TemporaryDirectory()
-atexit.register(TEST_DIR.cleanup)
-
-# Make sure Windows processes exit cleanly
-OLD_CWD = os.getcwd()
-atexit.register(lambda: os.chdir(OLD_CWD))
-os.chdir(TEST_DIR.name)
-
-def close_open_files():
-    everything = gc.get_objects()
-    for obj in everything:
-        if isinstance(obj, io.IOBase):
-            obj.close()
-
-atexit.register(close_open_files)
+# Write all output to a temporary directory and
+# close files left open at exit.
+# random(seed=1234), logging, pprint, STDOUTは `from bootstrap import random` のように
+# 使う時に取り出す(その時に初めてimportされる)
+from bootstrap import setup_environment
+setup_environment()
 
 
 # Example 1
@@ -124,3 +101,59 @@ for thread in threads:
 expected = how_many * 5
 found = counter.count
 print(f'Counter should be {expected}, got {found}')
+
+# Example 9
+# free-threadedなビルド(3.13t以降, GILなし)での見直し
+# - Counter: self.count += offset は読み出し→加算→書き込みの3段階(Example 5)なので,
+#   GILがあっても途中で割り込まれて数え損なう. GILが無いと複数のスレッドが本当に同時に
+#   走るので, 数え損ないはもっと頻繁に起こる. Counterは正しくないままである.
+# - LockingCounter: 読み出しから書き込みまでをLockで守っているので, GILが無くても正しい.
+#   最後のcounter.countの読み出しはthread.join()の後なので, ここではロックは要らない.
+# - ただし全スレッドが1つのLockを奪い合うので, GILが無いとロックの競合が遅さの原因になる.
+#   スレッドごとに別の枠に数えて, 読むときに合計すればincrementにロックは要らない.
+from threading import local
+
+class ShardedCounter:
+    def __init__(self):
+        self.lock = Lock()
+        self.shards = []
+        self.local = local()
+
+    def increment(self, offset):
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.local.shard = [0]
+            with self.lock:
+                self.shards.append(shard)
+        shard[0] += offset # 自分のスレッドしか書き込まない
+
+    @property
+    def count(self):
+        with self.lock:
+            return sum(shard[0] for shard in self.shards)
+
+# Example 10
+import time
+from bootstrap import gil_enabled
+
+print(f'GIL enabled: {gil_enabled()}')
+for counter_class in (LockingCounter, ShardedCounter):
+    BARRIER = Barrier(5)
+    counter = counter_class()
+    threads = []
+    start = time.time()
+    for i in range(5):
+        thread = Thread(target=worker,
+                        args=(i, how_many, counter))
+        threads.append(thread)
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+    end = time.time()
+
+    expected = how_many * 5
+    found = counter.count
+    assert found == expected
+    print(f'{counter_class.__name__}: {found} in {end - start:.3f} seconds')
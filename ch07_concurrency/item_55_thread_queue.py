@@ -1,33 +1,10 @@
 # Reproduce book environment
-import random
-random.seed(1234)
-
-import logging
-from pprint import pprint
-from sys import stdout as STDOUT
-
-# Write all output to a temporary directory
-import atexit
-import gc
-import io
-import os
-import tempfile
-
-TEST_DIR = tempfile.TemporaryDirectory()
-atexit.register(TEST_DIR.cleanup)
-
-# Make sure Windows processes exit cleanly
-OLD_CWD = os.getcwd()
-atexit.register(lambda: os.chdir(OLD_CWD))
-os.chdir(TEST_DIR.name)
-
-def close_open_files():
-    everything = gc.get_objects()
-    for obj in everything:
-        if isinstance(obj, io.IOBase):
-            obj.close()
-
-atexit.register(close_open_files)
+# Write all output to a temporary directory and
+# close files left open at exit.
+# random(seed=1234), logging, pprint, STDOUTは `from bootstrap import random` のように
+# 使う時に取り出す(その時に初めてimportされる)
+from bootstrap import setup_environment
+setup_environment()
 
 
 # Example 1
@@ -300,3 +277,644 @@ stop_threads(resize_queue, resize_threads)
 stop_threads(upload_queue, upload_threads)
 
 print(done_queue.qsize(), 'items finished')
+
+print("Deadline and priority aware queue -----")
+
+# Example 25
+# ClosableQueueは厳密なFIFO. 締め切りの厳しい仕事と, 急がない一括処理(backfill)が混ざるなら
+# - 優先度, 同じ優先度なら締め切りの早い順に取り出す
+# - 締め切りを過ぎた仕事は作業者に渡す前に捨てる(expired_queueがあればそちらに回す)
+# - 仕事の種類(job_class)ごとに重みで公平に取り出し, 一括処理がいつまでも後回しにならないようにする
+# Queueの_init/_qsize/_put/_getを差し替える(PriorityQueueと同じやり方)ので,
+# close()の番兵, task_done()/join(), StoppableWorker, stop_threadsはそのまま使える.
+import heapq
+from collections import namedtuple
+from queue import Full
+
+ScheduledItem = namedtuple('ScheduledItem', 'item priority deadline job_class')
+
+class DeadlineQueue(ClosableQueue):
+    def __init__(self, maxsize=0, weights=None, expired_queue=None):
+        self.weights = dict(weights or {})
+        self.expired_queue = expired_queue
+        super().__init__(maxsize)
+
+    def put_job(self, item, priority=0, deadline=None, job_class='default',
+                block=True, timeout=None):
+        # priorityは小さいほど先, deadlineはtime.monotonic()の値
+        self.put(ScheduledItem(item, priority, deadline, job_class), block, timeout)
+
+    def _init(self, maxsize):
+        self.heaps = {}     # job_class -> [(priority, deadline, 連番, item)]
+        self.sizes = {}     # job_class -> まだ取り出していない仕事の数
+        self.passes = {}    # job_class -> これまでに取り出した量(重みで割ったもの)
+        self.deadlines = [] # 締め切りのある仕事の(deadline, 連番, job_class, item)
+        self.removed = set()  # 期限切れで捨てたがヒープに残っている仕事の連番
+        self.finished = set() # 取り出したが締め切りのヒープに残っている仕事の連番
+        self.sentinels = deque()
+        self.counter = 0
+        self.expired = []
+        self.served = {}
+        self.dropped = 0
+
+    def _put(self, item):
+        if item is self.SENTINEL:
+            self.sentinels.append(item) # 番兵は仕事が無くなってから返す
+            return
+        if not isinstance(item, ScheduledItem):
+            item = ScheduledItem(item, 0, None, 'default')
+        job_class = item.job_class
+        if not self.sizes.get(job_class):
+            # 空だった種類が溜め込んだ分で他を押しのけないように, 今の最小値にそろえる
+            current = min((self.passes[c] for c, size in self.sizes.items() if size),
+                          default=0.0)
+            self.passes[job_class] = max(self.passes.get(job_class, 0.0), current)
+        self.counter += 1
+        deadline = float('inf')
+        if item.deadline is not None:
+            deadline = item.deadline
+            heapq.heappush(self.deadlines,
+                           (deadline, self.counter, job_class, item.item))
+        heapq.heappush(self.heaps.setdefault(job_class, []),
+                       (item.priority, deadline, self.counter, item.item))
+        self.sizes[job_class] = self.sizes.get(job_class, 0) + 1
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        while self.deadlines and self.deadlines[0][0] < now:
+            _, count, job_class, item = heapq.heappop(self.deadlines)
+            if count in self.finished:
+                self.finished.discard(count)
+                continue
+            # 種類ごとのヒープからは, 取り出すときに読み飛ばす
+            self.removed.add(count)
+            self.sizes[job_class] -= 1
+            self.dropped += 1
+            if self.expired_queue is not None:
+                # 回し終えてからtask_done()と同じことをする(forward_expired)
+                self.expired.append(item)
+            else:
+                # 作業者に渡さないので, ここでtask_done()と同じことをする
+                self.unfinished_tasks -= 1
+                if self.unfinished_tasks == 0:
+                    self.all_tasks_done.notify_all()
+            self.not_full.notify() # 空きができたのでputで待っている生産者を起こす
+
+    def forward_expired(self):
+        # 期限切れの仕事は, ロックを放してから別のキューに回す.
+        # 回し終えるまではjoin()が戻らないように, unfinished_tasksはそのあとで減らす
+        if self.expired_queue is None:
+            return
+        with self.mutex:
+            expired, self.expired = self.expired, []
+        for expired_item in expired:
+            self.expired_queue.put(expired_item)
+        if expired:
+            with self.all_tasks_done:
+                self.unfinished_tasks -= len(expired)
+                if self.unfinished_tasks == 0:
+                    self.all_tasks_done.notify_all()
+
+    def _qsize(self):
+        self._drop_expired()
+        return sum(self.sizes.values()) + len(self.sentinels)
+
+    def _get(self):
+        candidates = [c for c, size in self.sizes.items() if size]
+        if not candidates:
+            return self.sentinels.popleft()
+        # 次の1件を取り出したあとの値が最も小さい種類(同じなら重みの大きい方)を選ぶ
+        job_class = min(candidates, key=lambda c: (
+            self.passes[c] + 1 / self.weights.get(c, 1), -self.weights.get(c, 1)))
+        self.passes[job_class] += 1 / self.weights.get(job_class, 1)
+        self.served[job_class] = self.served.get(job_class, 0) + 1
+        self.sizes[job_class] -= 1
+        heap = self.heaps[job_class]
+        while True:
+            _, deadline, count, item = heapq.heappop(heap)
+            if count in self.removed:
+                self.removed.discard(count)
+                continue
+            if deadline != float('inf'):
+                self.finished.add(count)
+            return item
+
+    # _qsize()を通る(期限切れを捨てうる)操作はどれも, 最後に捨てたものを回す
+    def qsize(self):
+        try:
+            return super().qsize()
+        finally:
+            self.forward_expired()
+
+    def empty(self):
+        try:
+            return super().empty()
+        finally:
+            self.forward_expired()
+
+    def full(self):
+        try:
+            return super().full()
+        finally:
+            self.forward_expired()
+
+    def put(self, item, block=True, timeout=None):
+        try:
+            self.put_waiting(item, block, timeout)
+        finally:
+            self.forward_expired()
+
+    def put_waiting(self, item, block, timeout):
+        if self.maxsize <= 0 or not block:
+            return super().put(item, block, timeout)
+        # 満杯で待っている間にも締め切りは過ぎて空きができる. 他にgetする人がいなくても
+        # 気付けるように, 最も早い締め切りまでで一度起きて数え直す
+        endtime = None if timeout is None else time.monotonic() + timeout
+        with self.not_full:
+            while self._qsize() >= self.maxsize:
+                if getattr(self, 'is_shutdown', False):
+                    from queue import ShutDown # 3.13以降
+                    raise ShutDown
+                now = time.monotonic()
+                waits = []
+                if endtime is not None:
+                    if endtime <= now:
+                        raise Full
+                    waits.append(endtime - now)
+                if self.deadlines:
+                    waits.append(max(self.deadlines[0][0] - now, 0.0))
+                self.not_full.wait(min(waits, default=None))
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        try:
+            return super().get(block, timeout)
+        finally:
+            self.forward_expired() # Emptyで終わったgetの中で捨てたものも
+
+# Example 26
+# 締め切りのある仕事(urgent)と一括処理(bulk)を3:1で取り出す
+expired_queue = Queue()
+jobs_queue = DeadlineQueue(weights={'urgent': 3, 'bulk': 1},
+                           expired_queue=expired_queue)
+now = time.monotonic()
+for i in range(8):
+    jobs_queue.put_job(f'bulk {i}', job_class='bulk')
+for i in range(8):
+    jobs_queue.put_job(f'urgent {i}', priority=i % 2, deadline=now + 10,
+                       job_class='urgent')
+jobs_queue.put_job('too late', deadline=now - 1, job_class='urgent')
+
+order = []
+for _ in range(16):
+    order.append(jobs_queue.get())
+    jobs_queue.task_done()
+print(order)
+assert order[:8] == ['urgent 0', 'urgent 2', 'urgent 4', 'bulk 0',
+                     'urgent 6', 'urgent 1', 'urgent 3', 'bulk 1']
+assert 'too late' not in order
+assert expired_queue.get_nowait() == 'too late'
+jobs_queue.join() # 期限切れで捨てた仕事もjoinを止めない
+
+# Example 27
+# StoppableWorkerとstop_threadsでそのまま使える
+def slow_download(item):
+    time.sleep(0.001)
+    return item
+
+expired_queue = Queue()
+download_queue = DeadlineQueue(weights={'urgent': 3, 'bulk': 1},
+                               expired_queue=expired_queue)
+done_queue = ClosableQueue()
+
+now = time.monotonic()
+for i in range(300):
+    download_queue.put_job(i, job_class='bulk')
+for i in range(100):
+    # 締め切りが近すぎて, 一部は作業者が取り出す前に期限が切れる
+    download_queue.put_job(1000 + i, deadline=now + 0.002 * i, job_class='urgent')
+
+download_threads = start_threads(3, slow_download, download_queue, done_queue)
+stop_threads(download_queue, download_threads)
+
+print(done_queue.qsize(), 'items finished,',
+      download_queue.dropped, 'expired,',
+      download_queue.served, 'served')
+assert done_queue.qsize() + download_queue.dropped == 400
+assert expired_queue.qsize() == download_queue.dropped
+
+print("Network transparent queue -----")
+
+# Example 28
+# resizeの段に1台分より多くのコアを使いたいので, ClosableQueueをTCPで他のプロセス(他のマシン)から使えるようにする.
+# - QueueServer: 名前を付けたClosableQueueを公開する(キューを持つプロセスの中でスレッドとして動く)
+# - RemoteQueueClient/RemoteClosableQueue: put/get/task_done/close/join/__iter__がClosableQueueと同じ代理オブジェクト
+# 通信は長さ(4バイト) + pickleの単純なフレーム.
+# - 接続したらまずauthkeyで相互に認証する(multiprocessingのListener/Clientと同じチャレンジ応答).
+#   pickle.loadsは任意のコードを実行できるので, 認証前のフレームはunpickleしない
+# - putはbatch_size件ずつまとめて送る
+# - getはクレジット(一度に受け取ってよい件数)を付けて要求し, サーバーはそれ以上送らない.
+#   これは受け取る側の先読みの上限で, putの側にクレジットは無い. サーバー側のキューに
+#   maxsizeがあれば, 満杯の間はサーバーがソケットを読まなくなるのでTCPの流量制御で止まる
+# - task_doneは件数だけ数えておき, 次のget, join, flush, close時にまとめて送る.
+#   その前に必ず溜めたputを送るので, 次の段に結果が入る前にjoinが終わることはない.
+#   番兵を受け取ったあとのtask_done()ではすぐに送る(StoppableWorkerはそこで終わるので)
+# - putだけをする側は, 送り終えたいところでflush()を呼ぶ
+# - サーバーは1本の接続の要求を順に処理するので, あるスレッドのgetが待っている間は
+#   同じ接続の他の要求が届かない. そこで接続と受け取った要素はスレッドごとに持つ
+#   (StoppableWorkerを何本も起動して, 同じ代理オブジェクトを渡してよい)
+import os
+from threading import local
+import pickle
+import socket
+import socketserver
+import struct
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import answer_challenge, deliver_challenge
+from queue import Empty
+
+FRAME_HEADER = struct.Struct('!I')
+
+def write_bytes(file, data):
+    file.write(FRAME_HEADER.pack(len(data)) + data)
+
+def read_bytes(file, maxlength=None):
+    header = file.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None # 接続が閉じられた
+    size, = FRAME_HEADER.unpack(header)
+    if maxlength is not None and size > maxlength:
+        raise AuthenticationError(f'Frame too long: {size} bytes')
+    return file.read(size)
+
+def write_frame(file, message):
+    write_bytes(file, pickle.dumps(message))
+
+def read_frame(file):
+    data = read_bytes(file)
+    if data is None:
+        return None
+    return pickle.loads(data)
+
+class FrameConnection:
+    # deliver_challenge/answer_challengeが使うsend_bytes/recv_bytesだけを持つ
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+
+    def send_bytes(self, data):
+        write_bytes(self.wfile, data)
+        self.wfile.flush()
+
+    def recv_bytes(self, maxlength=None):
+        data = read_bytes(self.rfile, maxlength)
+        if data is None:
+            raise EOFError
+        return data
+
+def authenticate(rfile, wfile, authkey, server):
+    # 両方向に確かめる. 失敗するとAuthenticationErrorになる
+    connection = FrameConnection(rfile, wfile)
+    if server:
+        deliver_challenge(connection, authkey)
+        answer_challenge(connection, authkey)
+    else:
+        answer_challenge(connection, authkey)
+        deliver_challenge(connection, authkey)
+
+class QueueRequestHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        try:
+            authenticate(self.rfile, self.wfile, self.server.authkey, server=True)
+        except (AuthenticationError, EOFError, OSError):
+            return # 何も読まずに切断する
+        while (message := read_frame(self.rfile)) is not None:
+            op, name, *args = message
+            queue = self.server.queues[name]
+            if op == 'put':
+                items, = args
+                for item in items:
+                    queue.put(item)
+            elif op == 'get':
+                credits, = args
+                items = [queue.get()]
+                while len(items) < credits and items[-1] is not queue.SENTINEL:
+                    try:
+                        items.append(queue.get_nowait())
+                    except Empty:
+                        break
+                closed = items[-1] is queue.SENTINEL
+                if closed:
+                    items.pop() # 番兵は送らず, 閉じたことだけを伝える
+                write_frame(self.wfile, (items, closed))
+                self.wfile.flush()
+            elif op == 'task_done':
+                done, = args
+                for _ in range(done):
+                    queue.task_done()
+            elif op == 'close':
+                queue.close()
+            elif op == 'join':
+                queue.join()
+                write_frame(self.wfile, None)
+                self.wfile.flush()
+            elif op == 'qsize':
+                write_frame(self.wfile, queue.qsize())
+                self.wfile.flush()
+
+class QueueServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, queues, address=('127.0.0.1', 0), authkey=None):
+        self.queues = queues
+        # authkeyはクライアントに(コマンドライン以外の方法で)渡す
+        self.authkey = os.urandom(32) if authkey is None else authkey
+        super().__init__(address, QueueRequestHandler)
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class QueueConnection:
+    # 1つのスレッドが使う接続と, そのスレッドの送っていない要素, 受け取った要素
+    def __init__(self, address, authkey):
+        self.sock = socket.create_connection(tuple(address))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        self.wfile = self.sock.makefile('wb')
+        try:
+            authenticate(self.rfile, self.wfile, authkey, server=False)
+        except BaseException:
+            self.close_files()
+            raise
+        self.lock = Lock()        # close()だけは他のスレッドからも呼ばれる
+        self.pending_puts = {}    # 名前 -> まだ送っていない要素
+        self.pending_done = {}    # 名前 -> まだ送っていないtask_doneの数
+        self.buffers = {}         # 名前 -> 受け取ったが, まだ取り出していない要素
+        self.closing = set()      # 番兵を返し, そのtask_doneを待っているキューの名前
+
+    def write_pending(self):
+        for name, items in self.pending_puts.items():
+            if items:
+                write_frame(self.wfile, ('put', name, items))
+        for name, done in self.pending_done.items():
+            if done:
+                write_frame(self.wfile, ('task_done', name, done))
+        self.pending_puts = {}
+        self.pending_done = {}
+
+    def flush(self):
+        with self.lock:
+            self.write_pending()
+            self.wfile.flush()
+
+    def put(self, name, item, batch_size):
+        with self.lock:
+            items = self.pending_puts.setdefault(name, [])
+            items.append(item)
+            if len(items) >= batch_size:
+                self.write_pending()
+                self.wfile.flush()
+
+    def get(self, name, credits):
+        with self.lock:
+            buffer = self.buffers.setdefault(name, deque())
+            if not buffer:
+                self.write_pending()
+                write_frame(self.wfile, ('get', name, credits))
+                self.wfile.flush()
+                items, closed = read_frame(self.rfile)
+                buffer.extend(items)
+                if closed:
+                    buffer.append(ClosableQueue.SENTINEL)
+            item = buffer.popleft()
+            if item is ClosableQueue.SENTINEL:
+                self.closing.add(name)
+            return item
+
+    def task_done(self, name):
+        with self.lock:
+            self.pending_done[name] = self.pending_done.get(name, 0) + 1
+            if name not in self.closing:
+                return
+            self.closing.discard(name)
+            self.write_pending()
+            self.wfile.flush()
+
+    def send(self, message):
+        with self.lock:
+            self.write_pending()
+            write_frame(self.wfile, message)
+            self.wfile.flush()
+
+    def request(self, message):
+        with self.lock:
+            self.write_pending()
+            write_frame(self.wfile, message)
+            self.wfile.flush()
+            return read_frame(self.rfile)
+
+    def close_files(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+    def close(self):
+        self.flush()
+        self.close_files()
+
+class RemoteQueueClient:
+    def __init__(self, address, authkey, batch_size=64):
+        self.address = address
+        self.authkey = authkey
+        self.batch_size = batch_size
+        self.local = local()
+        self.lock = Lock()
+        self.connections = []
+        self.connection() # authkeyが違えばここでAuthenticationErrorになる
+
+    def connection(self):
+        # 呼び出したスレッドの接続. 初めてなら接続する
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = QueueConnection(self.address, self.authkey)
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def queue(self, name, credits=64):
+        return RemoteClosableQueue(self, name, credits)
+
+    def flush(self):
+        self.connection().flush()
+
+    def close(self):
+        # 全てのスレッドの接続に残っているputとtask_doneを送ってから閉じる
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            connection.close()
+
+class RemoteClosableQueue:
+    SENTINEL = ClosableQueue.SENTINEL
+
+    def __init__(self, client, name, credits):
+        self.client = client
+        self.name = name
+        self.credits = credits
+
+    def put(self, item):
+        self.client.connection().put(self.name, item, self.client.batch_size)
+
+    def get(self):
+        return self.client.connection().get(self.name, self.credits)
+
+    def task_done(self):
+        self.client.connection().task_done(self.name)
+
+    def flush(self):
+        self.client.connection().flush()
+
+    def close(self):
+        self.client.connection().send(('close', self.name))
+
+    def join(self):
+        self.client.connection().request(('join', self.name))
+
+    def qsize(self):
+        return self.client.connection().request(('qsize', self.name))
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            try:
+                if item is self.SENTINEL:
+                    return
+                yield item
+            finally:
+                self.task_done()
+
+# Example 29
+# 別のプロセスで動くStoppableWorkerの代わり. bootstrapのstart_workerで起動するので,
+# このスクリプトのExampleはワーカーでは実行されない
+def remote_worker(address, authkey, func_name, in_name, out_name, credits=64):
+    client = RemoteQueueClient(address, authkey)
+    in_queue = client.queue(in_name, credits=credits)
+    out_queue = client.queue(out_name)
+    func = globals()[func_name]
+    count = 0
+    for item in in_queue:
+        out_queue.put(func(item))
+        count += 1
+    client.close()
+    return count
+
+def start_remote_workers(count, server, *args):
+    # 引数はパイプでpickleして渡すので, authkeyはコマンドラインや環境変数に出ない
+    return [start_worker(__file__, 'remote_worker',
+                         server.server_address, server.authkey, *args)
+            for _ in range(count)]
+
+def stop_remote_workers(closable_queue, workers):
+    # stop_threadsと同じ: 作業者の数だけ番兵を入れ, joinしてから終わりを待つ
+    for _ in workers:
+        closable_queue.close()
+
+    closable_queue.join()
+
+    return [worker.result(timeout=60) for worker in workers]
+
+# Example 30
+# download, uploadはこのプロセスのスレッドで, resizeは別プロセスのワーカーで行う
+from bootstrap import start_worker
+
+def run_remote_pipeline(remote_count, item_count):
+    download_queue = ClosableQueue()
+    resize_queue = ClosableQueue()
+    upload_queue = ClosableQueue()
+    done_queue = ClosableQueue()
+    server = QueueServer({'resize': resize_queue, 'upload': upload_queue})
+
+    download_threads = start_threads(3, download, download_queue, resize_queue)
+    resize_workers = start_remote_workers(
+        remote_count, server, 'resize', 'resize', 'upload')
+    upload_threads = start_threads(5, upload, upload_queue, done_queue)
+
+    start = time.time()
+    for i in range(item_count):
+        download_queue.put(i)
+
+    stop_threads(download_queue, download_threads)
+    counts = stop_remote_workers(resize_queue, resize_workers)
+    stop_threads(upload_queue, upload_threads)
+    end = time.time()
+    server.stop()
+
+    assert sum(counts) == item_count
+    assert sorted(done_queue.queue) == list(range(item_count))
+    return counts, end - start
+
+counts, delta = run_remote_pipeline(2, 1000)
+print(sum(counts), 'items finished,', counts, 'resized remotely')
+
+# 逆向き: 代理オブジェクト側からのput, close, joinもサーバー側のキューに届く
+jobs_queue = ClosableQueue()
+results_queue = ClosableQueue()
+server = QueueServer({'jobs': jobs_queue})
+worker = StoppableWorker(upload, jobs_queue, results_queue)
+worker.start()
+client = RemoteQueueClient(server.server_address, server.authkey)
+remote_jobs = client.queue('jobs')
+for i in range(100):
+    remote_jobs.put(i)
+remote_jobs.close()
+remote_jobs.join()        # サーバー側の作業者が全部終えるまで戻らない
+assert results_queue.qsize() == 100
+worker.join()
+client.close()
+
+# 同じ代理オブジェクトをStoppableWorkerのスレッドにそのまま渡せる. 各スレッドは番兵のあと,
+# putとtask_doneを送ってから終わるので, サーバー側のstop_threadsやjoinは待ち続けない
+resize_queue = ClosableQueue()
+upload_queue = ClosableQueue()
+server.queues.update({'resize': resize_queue, 'upload': upload_queue})
+client = RemoteQueueClient(server.server_address, server.authkey)
+resize_threads = start_threads(3, resize, client.queue('resize'), client.queue('upload'))
+for i in range(10):
+    resize_queue.put(i)
+stop_threads(resize_queue, resize_threads)
+assert sorted(upload_queue.queue) == list(range(10))
+
+# putだけならflush()で送る
+remote_upload = client.queue('upload')
+for i in range(5):
+    remote_upload.put(i)
+remote_upload.flush()
+assert remote_upload.qsize() == 15
+client.close()
+
+# authkeyが違えば, サーバーは何もunpickleせずに切断する
+try:
+    RemoteQueueClient(server.server_address, b'wrong key')
+except AuthenticationError as e:
+    print(f'Error: {e!r}')
+else:
+    assert False
+server.stop()
+
+# Example 31
+# ベンチマーク: リモートのresizeワーカーを増やしたときのスループット
+# ここのresizeは何もしないので, 数値はキューのサーバーと通信の上限を表す.
+# resizeが重いほど(そしてコアやマシンが多いほど), ワーカーを増やした分だけ伸びる
+for remote_count in (1, 2, 4):
+    counts, delta = run_remote_pipeline(remote_count, 20000)
+    print(f'{remote_count} remote workers: {20000 / delta:.0f} items/second '
+          f'(per worker {counts})')
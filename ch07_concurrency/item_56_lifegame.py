@@ -1,33 +1,10 @@
 # Reproduce book environment
-import random
-random.seed(1234)
-
-import logging
-from pprint import pprint
-from sys import stdout as STDOUT
-
-# Write all output to a temporary directory
-import atexit
-import gc
-import io
-import os
-import tempfile
-
-TEST_DIR = tempfile.TemporaryDirectory()
-atexit.register(TEST_DIR.cleanup)
-
-# Make sure Windows processes exit cleanly
-OLD_CWD = os.getcwd()
-atexit.register(lambda: os.chdir(OLD_CWD))
-os.chdir(TEST_DIR.name)
-
-def close_open_files():
-    everything = gc.get_objects()
-    for obj in everything:
-        if isinstance(obj, io.IOBase):
-            obj.close()
-
-atexit.register(close_open_files)
+# Write all output to a temporary directory and
+# close files left open at exit.
+# random(seed=1234), logging, pprint, STDOUTは `from bootstrap import random` のように
+# 使う時に取り出す(その時に初めてimportされる)
+from bootstrap import setup_environment
+setup_environment()
 
 # Example 1
 ALIVE = '*'
@@ -203,6 +180,730 @@ for i in range(5):
 print(columns)
 
 # Example 9
+# 本物のソケットの代わりに, recvで少し待つだけのもの(ブロッキングI/Oの真似)
+import time
+
+class FakeSocket:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def recv(self, size):
+        time.sleep(self.delay)
+        return b''
+
+my_socket = FakeSocket(0.0001)
+
 def game_logic(state, neighbors):
     # do some  blocking input/output in here
-    data = my_socket.rec(100)
\ No newline at end of file
+    data = my_socket.recv(100)
+    if state == ALIVE:
+        if neighbors < 2:
+            return EMPTY # Die: Too few
+        elif neighbors > 3: # Die: Too many
+            return EMPTY
+    else:
+        if neighbors == 3:
+            return ALIVE # Regenerate
+    return state
+
+game_logic_io = game_logic
+
+# Example 10
+# Example 9のgame_logicはセルごとにブロッキングI/Oで待つので, 以降の例ではExample 5のルールに戻しておく.
+# I/Oで待つ版(game_logic_io)はExample 21のスレッド版で使う
+def game_logic(state, neighbors):
+    if state == ALIVE:
+        if neighbors < 2:
+            return EMPTY # Die: Too few
+        elif neighbors > 3: # Die: Too many
+            return EMPTY
+    else:
+        if neighbors == 3:
+            return ALIVE # Regenerate
+    return state
+
+# Example 11
+# Gridを保存する方法は__str__(1セル1バイト+改行)しかなく, 読み戻すこともできない.
+# 大きな盤面で長くsimulate()するときのチェックポイント用に, スナップショットのファイル形式を作る.
+#
+#   ファイルヘッダ: b'LIFE', バージョン, 高さ, 幅, キーフレームの間隔
+#   レコード:       世代番号, 種類, ペイロードの長さ, ペイロード
+#     KEYFRAME: 1セル1ビットに詰めた盤面(行優先)
+#     DELTA:    直前の世代とのXORをランレングス符号化したもの((連続数, バイト値)の並び)
+#
+# 続く世代は差分で追記し, keyframe_intervalごとにキーフレームを入れて復元の手間を抑える.
+# 追記の途中で落ちると最後のレコードが欠けるので, 読むときは完全なレコードまでを使う.
+import mmap
+import os
+import struct
+
+SNAPSHOT_MAGIC = b'LIFE'
+SNAPSHOT_VERSION = 1
+FILE_HEADER = struct.Struct('<4sBIIH')
+RECORD_HEADER = struct.Struct('<QBI')
+KEYFRAME = 0
+DELTA = 1
+RUN = struct.Struct('<HB')
+
+def pack_grid(grid):
+    bits = bytearray((grid.height * grid.width + 7) // 8)
+    i = 0
+    for row in grid.rows:
+        for cell in row:
+            if cell == ALIVE:
+                bits[i >> 3] |= 1 << (i & 7)
+            i += 1
+    return bits
+
+def unpack_grid(bits, height, width):
+    grid = Grid(height, width)
+    i = 0
+    for row in grid.rows:
+        for x in range(width):
+            if bits[i >> 3] & (1 << (i & 7)):
+                row[x] = ALIVE
+            i += 1
+    return grid
+
+def encode_runs(data):
+    output = bytearray()
+    i = 0
+    while i < len(data):
+        value = data[i]
+        j = i + 1
+        while j < len(data) and data[j] == value and j - i < 0xFFFF:
+            j += 1
+        output += RUN.pack(j - i, value)
+        i = j
+    return output
+
+def decode_runs(data, size):
+    output = bytearray()
+    for count, value in RUN.iter_unpack(data):
+        output += bytes([value]) * count
+    assert len(output) == size
+    return output
+
+class SnapshotWriter:
+    def __init__(self, path, height, width, keyframe_interval=16):
+        self.file = open(path, 'wb')
+        self.file.write(FILE_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, height, width, keyframe_interval))
+        self.height = height
+        self.width = width
+        self.keyframe_interval = keyframe_interval
+        self.previous = None # 直前に書いた世代の詰めたビット列
+        self.since_keyframe = 0
+
+    @classmethod
+    def resume(cls, path, generation=None):
+        # generationまでのレコードを残してファイルを切り詰め, その続きから追記する.
+        # Noneなら最後の完全な世代から(欠けたレコードは捨てる)
+        with SnapshotReader(path) as reader:
+            if generation is None:
+                generation = reader.generations[-1]
+            grid = reader.load(generation)
+            offset, _, length = reader.records[generation]
+            end = offset + RECORD_HEADER.size + length
+            since_keyframe = 0 # 直前のキーフレームからgenerationまでのレコード数
+            for g in reader.generations:
+                if g > generation:
+                    break
+                if reader.records[g][1] == KEYFRAME:
+                    since_keyframe = 0
+                since_keyframe += 1
+            keyframe_interval = reader.keyframe_interval
+
+        writer = cls.__new__(cls)
+        writer.file = open(path, 'r+b')
+        writer.file.truncate(end)
+        writer.file.seek(end)
+        writer.height = grid.height
+        writer.width = grid.width
+        writer.keyframe_interval = keyframe_interval
+        writer.previous = pack_grid(grid)
+        writer.since_keyframe = since_keyframe
+        return writer, grid
+
+    def append(self, grid, generation):
+        bits = pack_grid(grid)
+        if self.previous is None or self.since_keyframe >= self.keyframe_interval:
+            kind, payload = KEYFRAME, bits
+            self.since_keyframe = 1
+        else:
+            diff = bytes(a ^ b for a, b in zip(bits, self.previous))
+            kind, payload = DELTA, encode_runs(diff)
+            self.since_keyframe += 1
+        self.file.write(RECORD_HEADER.pack(generation, kind, len(payload)))
+        self.file.write(payload)
+        self.file.flush() # 落ちても, 書き終えた世代まではファイルに残るように
+        self.previous = bits
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SnapshotReader:
+    # mmapでファイルを開き, レコードの位置だけを索引にする(盤面はデコードしない)
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        if os.fstat(self.file.fileno()).st_size < FILE_HEADER.size:
+            self.file.close()
+            raise ValueError(f'Not a Life snapshot: {path}')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.height, self.width,
+         self.keyframe_interval) = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f'Not a Life snapshot: {path}')
+        self.size = (self.height * self.width + 7) // 8
+
+        self.records = {} # 世代 -> (オフセット, 種類, 長さ)
+        self.generations = []
+        offset = FILE_HEADER.size
+        # 最後のレコードが欠けていたら(ヘッダかペイロードが途中まで), その手前までを使う
+        while offset + RECORD_HEADER.size <= len(self.map):
+            generation, kind, length = RECORD_HEADER.unpack_from(self.map, offset)
+            if offset + RECORD_HEADER.size + length > len(self.map):
+                break
+            self.records[generation] = (offset, kind, length)
+            self.generations.append(generation)
+            offset += RECORD_HEADER.size + length
+        self.torn = offset < len(self.map) # 欠けたレコードがあったか
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def payload(self, generation):
+        offset, kind, length = self.records[generation]
+        start = offset + RECORD_HEADER.size
+        return kind, memoryview(self.map)[start:start + length]
+
+    def bits(self, generation):
+        # 直前のキーフレームから差分を順に当てる
+        index = self.generations.index(generation)
+        start = index
+        while self.records[self.generations[start]][1] != KEYFRAME:
+            start -= 1
+        with self.payload(self.generations[start])[1] as view:
+            bits = bytearray(view)
+        for g in self.generations[start + 1:index + 1]:
+            _, view = self.payload(g)
+            with view:
+                diff = decode_runs(view, self.size)
+            for i, value in enumerate(diff):
+                if value:
+                    bits[i] ^= value
+        return bits
+
+    def get(self, generation, y, x):
+        # キーフレームなら該当する1ビットだけをmmapから直接読む
+        i = (y % self.height) * self.width + (x % self.width)
+        kind, view = self.payload(generation)
+        with view:
+            if kind == KEYFRAME:
+                return ALIVE if view[i >> 3] & (1 << (i & 7)) else EMPTY
+        bits = self.bits(generation)
+        return ALIVE if bits[i >> 3] & (1 << (i & 7)) else EMPTY
+
+    def load(self, generation):
+        return unpack_grid(self.bits(generation), self.height, self.width)
+
+# Example 12
+# グライダーを走らせながらスナップショットを取る
+def glider_grid(height, width):
+    grid = Grid(height, width)
+    grid.set(0, 3, ALIVE)
+    grid.set(1, 4, ALIVE)
+    grid.set(2, 2, ALIVE)
+    grid.set(2, 3, ALIVE)
+    grid.set(2, 4, ALIVE)
+    return grid
+
+grid = glider_grid(64, 64)
+states = [grid]
+with SnapshotWriter('life.snapshot', grid.height, grid.width,
+                    keyframe_interval=8) as writer:
+    for generation in range(40):
+        writer.append(grid, generation)
+        grid = simulate(grid)
+        states.append(grid)
+
+text_size = len(str(states[0])) * 40
+snapshot_size = os.path.getsize('life.snapshot')
+print(f'__str__: {text_size} bytes, snapshot: {snapshot_size} bytes')
+
+with SnapshotReader('life.snapshot') as reader:
+    for generation in (0, 7, 8, 21, 39):
+        assert str(reader.load(generation)) == str(states[generation])
+    assert reader.get(0, 2, 2) == ALIVE
+    assert reader.get(0, 0, 0) == EMPTY
+
+# Example 13
+# 途中の世代から再開する. 再開後の結果は通しで計算したものと一致する
+writer, grid = SnapshotWriter.resume('life.snapshot', 20)
+with writer:
+    for generation in range(20, 40):
+        grid = simulate(grid)
+        writer.append(grid, generation + 1)
+
+with SnapshotReader('life.snapshot') as reader:
+    assert reader.generations == list(range(41))
+    for generation in (20, 33, 40):
+        assert str(reader.load(generation)) == str(states[generation])
+    print(f'Resumed from 20 up to {reader.generations[-1]}')
+
+# 追記の途中で落ちた(最後のレコードが欠けた)ファイルも, 完全な世代までは読めて再開できる
+with open('life.snapshot', 'rb') as source, open('torn.snapshot', 'wb') as torn:
+    torn.write(source.read()[:-3])
+
+with SnapshotReader('torn.snapshot') as reader:
+    assert reader.torn
+    assert reader.generations == list(range(40))
+
+writer, grid = SnapshotWriter.resume('torn.snapshot')
+with writer:
+    grid = simulate(grid)
+    writer.append(grid, 40)
+
+with SnapshotReader('torn.snapshot') as reader:
+    assert not reader.torn
+    assert str(reader.load(40)) == str(states[40])
+
+# Example 14
+# 多くの盤面は数百世代で固定物(still life)や短い周期の振動子に落ち着く.
+# その後もsimulate()を呼び続けると同じ状態を何度も計算することになるので,
+# 世代ごとのハッシュで一定の履歴の中に同じ状態が現れたかを調べ, 周期が分かったら計算を省く.
+#
+# ハッシュはZobrist hashing: セルごとに乱数を割り当て, 生きているセルの乱数のXORとする.
+# セルの状態が変わったときにその乱数をXORするだけで次の世代のハッシュが求まる(差分更新).
+from collections import deque
+from bootstrap import random
+
+class CycleDetector:
+    def __init__(self, grid, history=1024):
+        rng = random.Random(1234)
+        self.keys = [[rng.getrandbits(64) for _ in range(grid.width)]
+                     for _ in range(grid.height)]
+        self.grid = grid
+        self.generation = 0
+        self.hash = 0
+        for y, row in enumerate(grid.rows):
+            for x, cell in enumerate(row):
+                if cell == ALIVE:
+                    self.hash ^= self.keys[y][x]
+        self.history = history
+        self.window = deque() # 履歴に残している世代
+        self.states = {}      # 世代 -> (ハッシュ, 詰めたビット列)
+        self.seen = {}        # ハッシュ -> [世代]
+        self.period = None
+        self.cycle_start = None
+        self.remember()
+
+    def remember(self):
+        bits = pack_grid(self.grid)
+        for generation in self.seen.get(self.hash, []):
+            if self.states[generation][1] == bits: # ハッシュの衝突ではないことを確かめる
+                self.cycle_start = generation
+                self.period = self.generation - generation
+                return
+        self.seen.setdefault(self.hash, []).append(self.generation)
+        self.states[self.generation] = (self.hash, bits)
+        self.window.append(self.generation)
+        if len(self.window) > self.history:
+            generation = self.window.popleft()
+            old_hash, _ = self.states.pop(generation)
+            self.seen[old_hash].remove(generation)
+            if not self.seen[old_hash]:
+                del self.seen[old_hash]
+
+    def step(self):
+        grid = self.grid
+        next_grid = Grid(grid.height, grid.width)
+        for y in range(grid.height):
+            row = grid.rows[y]
+            keys = self.keys[y]
+            for x in range(grid.width):
+                step_cell(y, x, grid.get, next_grid.set)
+                if next_grid.rows[y][x] != row[x]:
+                    self.hash ^= keys[x]
+        self.grid = next_grid
+        self.generation += 1
+        self.remember()
+
+    def run(self, generations):
+        # 周期が見つかるかgenerations世代まで進める
+        while self.period is None and self.generation < generations:
+            self.step()
+
+    def state_at(self, generation):
+        self.run(generation)
+        if generation == self.generation:
+            return self.grid
+        if self.period is not None and generation >= self.cycle_start:
+            generation = self.cycle_start + (generation - self.cycle_start) % self.period
+        if generation not in self.states:
+            raise ValueError(f'Generation {generation} is outside of the history window')
+        _, bits = self.states[generation]
+        return unpack_grid(bits, self.grid.height, self.grid.width)
+
+# Example 15
+# ブリンカー(周期2)とブロック(固定物)
+grid = Grid(16, 16)
+grid.set(2, 1, ALIVE)
+grid.set(2, 2, ALIVE)
+grid.set(2, 3, ALIVE)
+grid.set(10, 10, ALIVE)
+grid.set(10, 11, ALIVE)
+grid.set(11, 10, ALIVE)
+grid.set(11, 11, ALIVE)
+
+detector = CycleDetector(grid)
+detector.run(1000)
+print(f'Period {detector.period} starting at generation {detector.cycle_start}')
+assert (detector.period, detector.cycle_start) == (2, 0)
+
+# L字の3セルは1世代でブロックになる
+grid = Grid(8, 8)
+grid.set(3, 3, ALIVE)
+grid.set(3, 4, ALIVE)
+grid.set(4, 3, ALIVE)
+detector = CycleDetector(grid)
+detector.run(1000)
+print(f'Period {detector.period} starting at generation {detector.cycle_start}')
+assert (detector.period, detector.cycle_start) == (1, 1)
+
+# トーラス上のグライダーは4世代で1マス斜めに進むので, 16x16では64世代で元に戻る
+detector = CycleDetector(glider_grid(16, 16))
+detector.run(1000)
+print(f'Period {detector.period} starting at generation {detector.cycle_start}')
+assert (detector.period, detector.cycle_start) == (64, 0)
+
+# 周期が分かれば, どれだけ先の世代でも計算せずに答えられる
+start = 150
+grid = glider_grid(16, 16)
+for _ in range(start):
+    grid = simulate(grid)
+assert str(detector.state_at(start)) == str(grid)
+print(detector.state_at(10**12))
+
+# Example 16
+# game_logicはConwayのルール(B3/S23)をif文で書いていて, step_cellから1セルごとに呼ばれる.
+# HighLifeやSeedsなどのLife-likeなルールも扱えるように, B/S形式のルール文字列から
+# 表を作っておき, セルごとには表を引くだけにする(分岐なし).
+#   - next_state[状態][近傍の生きたセルの数]: game_logicの置き換え
+#   - table[9セルのビットマスク]: 周囲9セルをまとめて引く. 速い盤面の実装からも使える
+import re
+import time
+
+LIFE_RULES = {
+    'Conway': 'B3/S23',
+    'HighLife': 'B36/S23',
+    'Seeds': 'B2/S',
+    'Day & Night': 'B3678/S34678',
+}
+
+CENTER_BIT = 1 << 4 # 近傍のビットの並び: 上の行(8,7,6), 同じ行(5,4,3), 下の行(2,1,0)
+
+def parse_rule(rule):
+    born = survive = None
+    for part in rule.upper().split('/'):
+        match = re.fullmatch(r'([BS])([0-8]*)', part)
+        if match is None:
+            raise ValueError(f'Invalid rule: {rule!r}')
+        counts = frozenset(int(digit) for digit in match.group(2))
+        if match.group(1) == 'B':
+            born = counts
+        else:
+            survive = counts
+    if born is None or survive is None:
+        raise ValueError(f'Invalid rule: {rule!r}')
+    return born, survive
+
+class LifeRule:
+    def __init__(self, rule):
+        self.rule = rule
+        self.born, self.survive = parse_rule(rule)
+        self.next_state = {
+            ALIVE: [ALIVE if n in self.survive else EMPTY for n in range(9)],
+            EMPTY: [ALIVE if n in self.born else EMPTY for n in range(9)],
+        }
+        self.table = []
+        for index in range(512):
+            neighbors = bin(index & ~CENTER_BIT).count('1')
+            if index & CENTER_BIT:
+                self.table.append(int(neighbors in self.survive))
+            else:
+                self.table.append(int(neighbors in self.born))
+
+    def game_logic(self, state, neighbors):
+        return self.next_state[state][neighbors]
+
+    def simulate(self, grid):
+        height, width = grid.height, grid.width
+        cells = [[int(cell == ALIVE) for cell in row] for row in grid.rows]
+        states = (EMPTY, ALIVE)
+        table = self.table
+        next_grid = Grid(height, width)
+        for y in range(height):
+            up, row, down = cells[y - 1], cells[y], cells[(y + 1) % height]
+            next_row = next_grid.rows[y]
+            for x in range(width):
+                left, right = x - 1, (x + 1) % width
+                index = (up[left] << 8 | up[x] << 7 | up[right] << 6 |
+                         row[left] << 5 | row[x] << 4 | row[right] << 3 |
+                         down[left] << 2 | down[x] << 1 | down[right])
+                next_row[x] = states[table[index]]
+        return next_grid
+
+# Example 17
+# B3/S23はExample 5のgame_logicと完全に一致する
+conway = LifeRule(LIFE_RULES['Conway'])
+assert conway.game_logic(ALIVE, 0) == EMPTY
+assert conway.game_logic(ALIVE, 1) == EMPTY
+assert conway.game_logic(ALIVE, 2) == ALIVE
+assert conway.game_logic(ALIVE, 3) == ALIVE
+assert conway.game_logic(ALIVE, 4) == EMPTY
+assert conway.game_logic(EMPTY, 0) == EMPTY
+assert conway.game_logic(EMPTY, 1) == EMPTY
+assert conway.game_logic(EMPTY, 2) == EMPTY
+assert conway.game_logic(EMPTY, 3) == ALIVE
+assert conway.game_logic(EMPTY, 4) == EMPTY
+for state in (ALIVE, EMPTY):
+    for neighbors in range(9):
+        assert conway.game_logic(state, neighbors) == game_logic(state, neighbors)
+
+assert parse_rule('S23/B3') == parse_rule('b3/s23')
+try:
+    parse_rule('B9/S23')
+except ValueError as e:
+    print(f'Error: {e}')
+
+# simulate()とも一致する
+grid = Grid(32, 32)
+for y in range(grid.height):
+    for x in range(grid.width):
+        if random.random() < 0.3:
+            grid.set(y, x, ALIVE)
+
+expected = grid
+actual = grid
+for _ in range(10):
+    expected = simulate(expected)
+    actual = conway.simulate(actual)
+    assert str(actual) == str(expected)
+
+start = time.time()
+for _ in range(10):
+    grid = simulate(grid)
+end = time.time()
+print(f'simulate: {end - start:.3f} seconds')
+
+start = time.time()
+for _ in range(10):
+    grid = conway.simulate(grid)
+end = time.time()
+print(f'LifeRule.simulate: {end - start:.3f} seconds')
+
+# Example 18
+# 他のルールでも同じように動かせる
+for name, rule in LIFE_RULES.items():
+    life_rule = LifeRule(rule)
+    grid = glider_grid(5, 6)
+    columns = ColumnPrinter()
+    for i in range(4):
+        columns.append(str(grid))
+        grid = life_rule.simulate(grid)
+    print(f'{name} ({rule})')
+    print(columns)
+
+# Example 19
+# 盤面を行のまとまり(タイル)に分けて, タイルごとに次の世代を計算する.
+# bootstrapのparallel_mapはGILが無効(free-threaded)ならスレッドで, 有効ならワーカープロセスで実行する.
+# ワーカープロセスにも渡せるように, Gridではなく行のリストを渡して行のリストを受け取る.
+from bootstrap import gil_enabled, parallel_map
+
+def step_tile(rows, start, stop):
+    height, width = len(rows), len(rows[0])
+
+    def get(y, x):
+        return rows[y % height][x % width]
+
+    next_rows = []
+    for y in range(start, stop):
+        next_row = []
+        for x in range(width):
+            neighbors = count_neighbors(y, x, get)
+            next_row.append(game_logic(rows[y][x], neighbors))
+        next_rows.append(next_row)
+    return next_rows
+
+def simulate_tiled(grid, tiles=4, mode=None):
+    bounds = [grid.height * i // tiles for i in range(tiles + 1)]
+    results = parallel_map(step_tile, [grid.rows] * tiles, bounds[:-1], bounds[1:],
+                           max_workers=tiles, mode=mode)
+    next_grid = Grid(grid.height, grid.width)
+    next_grid.rows = [row for tile in results for row in tile]
+    return next_grid
+
+# Example 20
+# GILのあるビルドとfree-threadedなビルドの両方でこのスクリプトを実行して比べる
+grid = Grid(128, 128)
+for y in range(grid.height):
+    for x in range(grid.width):
+        if random.random() < 0.3:
+            grid.set(y, x, ALIVE)
+
+print(f'GIL enabled: {gil_enabled()}')
+start = time.time()
+expected = grid
+for _ in range(5):
+    expected = simulate(expected)
+end = time.time()
+print(f'simulate: {(end - start) / 5:.3f} seconds per generation')
+
+# ワーカープロセスは最初の呼び出しで起動し(スクリプトの読み込みもその時だけ), 以降は使い回す
+for mode in ('threads', 'processes', None):
+    actual = grid
+    deltas = []
+    for _ in range(5):
+        start = time.time()
+        actual = simulate_tiled(actual, mode=mode)
+        deltas.append(time.time() - start)
+    assert str(actual) == str(expected)
+    print(f'simulate_tiled ({mode or "auto"}): first {deltas[0]:.3f} seconds, '
+          f'then {min(deltas[1:]):.3f} seconds per generation')
+
+# Example 21
+# Example 9のようにセルごとにブロッキングI/Oで待つなら, GILがあってもスレッドで待ち時間を重ねられる.
+# 1セルに1スレッドではなく, 決まった数のスレッドを最初に起動して行を分担させる.
+# - 世代の区切りはthreading.Barrierで揃える(最後に着いたスレッドがactionでバッファを入れ替える)
+# - 読むバッファ(current)と書くバッファ(next)を2つ持ち, 世代ごとに入れ替える.
+#   同じ世代の中では誰も読むバッファに書かず, 書く行はスレッドごとに重ならないのでLockは要らない.
+#   世代ごとにGridも作らない
+from threading import Barrier, Thread
+
+class BarrierSimulator:
+    def __init__(self, grid, num_threads=4, logic=None):
+        self.height = grid.height
+        self.width = grid.width
+        self.current = [list(row) for row in grid.rows]
+        self.next = [list(row) for row in grid.rows]
+        self.logic = logic or game_logic
+        self.generations = 0
+        self.stopping = False
+        # runを呼んだスレッドと作業スレッドが, 開始と終了で待ち合わせる
+        self.control = Barrier(num_threads + 1)
+        self.step = Barrier(num_threads, action=self.swap)
+        bounds = [self.height * i // num_threads for i in range(num_threads + 1)]
+        self.threads = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            thread = Thread(target=self.work, args=(start, stop), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def swap(self):
+        self.current, self.next = self.next, self.current
+
+    def step_rows(self, start, stop):
+        current, next_rows = self.current, self.next
+        height, width = self.height, self.width
+
+        def get(y, x):
+            return current[y % height][x % width]
+
+        for y in range(start, stop):
+            next_row = next_rows[y]
+            for x in range(width):
+                neighbors = count_neighbors(y, x, get)
+                next_row[x] = self.logic(current[y][x], neighbors)
+
+    def work(self, start, stop):
+        try:
+            while True:
+                self.control.wait()
+                if self.stopping:
+                    return
+                for _ in range(self.generations):
+                    self.step_rows(start, stop)
+                    self.step.wait()
+                self.control.wait()
+        except BaseException:
+            # 他のスレッドとrunを待たせたままにしない(BrokenBarrierErrorになる)
+            self.control.abort()
+            self.step.abort()
+            raise
+
+    def run(self, generations):
+        self.generations = generations
+        self.control.wait() # 開始
+        self.control.wait() # 全員がgenerations世代を終えた
+        return self.grid
+
+    @property
+    def grid(self):
+        grid = Grid(self.height, self.width)
+        grid.rows = [list(row) for row in self.current]
+        return grid
+
+    def close(self):
+        self.stopping = True
+        self.control.wait()
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Example 22
+# simulate()と同じ結果になる
+grid = glider_grid(5, 6)
+expected = grid
+with BarrierSimulator(grid, num_threads=2) as simulator:
+    for _ in range(3):
+        for _ in range(4):
+            expected = simulate(expected)
+        assert str(simulator.run(4)) == str(expected)
+
+grid = Grid(64, 64)
+for y in range(grid.height):
+    for x in range(grid.width):
+        if random.random() < 0.3:
+            grid.set(y, x, ALIVE)
+
+expected = grid
+for _ in range(10):
+    expected = simulate(expected)
+for num_threads in (1, 3, 8):
+    with BarrierSimulator(grid, num_threads=num_threads) as simulator:
+        assert str(simulator.run(10)) == str(expected)
+
+# セルごとにブロッキングI/Oがあると, スレッドを増やした分だけ待ち時間が重なる
+grid = glider_grid(16, 16)
+expected = grid
+for _ in range(5):
+    expected = simulate(expected)
+for num_threads in (1, 4, 16):
+    with BarrierSimulator(grid, num_threads=num_threads,
+                          logic=game_logic_io) as simulator:
+        start = time.time()
+        actual = simulator.run(5)
+        end = time.time()
+    assert str(actual) == str(expected)
+    print(f'BarrierSimulator ({num_threads} threads, blocking I/O): '
+          f'{end - start:.3f} seconds')